@@ -0,0 +1,79 @@
+"""
+Memory-mapped, zero-copy access to firmware and flash images.
+
+Slices are handed out as buffer objects (memoryview on Python 3),
+nothing is copied until it gets written out or parsed.
+"""
+
+import mmap
+import os
+import struct
+
+try:
+    buffer
+except NameError:
+    def view(data, offset=0, size=None):
+        "Zero-copy slice of a bytes, bytearray, mmap or memoryview"
+        if size is None:
+            size = len(data) - offset
+        return memoryview(data)[offset:offset + size]
+else:
+    def view(data, offset=0, size=None):
+        "Zero-copy slice of a string, bytearray, mmap or memoryview"
+        if size is None:
+            size = len(data) - offset
+        if isinstance(data, memoryview):
+            return data[offset:offset + size]
+        # Python 2 mmap has no new-style buffer interface.
+        return buffer(data, offset, size)
+
+class Image(object):
+    """
+    A read-only mapping of an image file; slices are taken
+    by file offset, or by address once the base is known
+    """
+
+    def __init__(self, path, base=None):
+        self.path = path
+        self.base = base
+        with open(path, 'rb') as fp:
+            if os.fstat(fp.fileno()).st_size:
+                self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                # Empty files can't be mapped.
+                self.data = b''
+    def __len__(self):
+        return len(self.data)
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc_info):
+        self.close()
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+    def view(self, offset, size=None):
+        "Zero-copy slice at a file offset, clipped at the end of the image"
+        if offset < 0:
+            raise ValueError('negative image offset %d' % offset)
+        if size is None:
+            size = len(self.data) - offset
+        size = max(0, min(size, len(self.data) - offset))
+        return view(self.data, offset, size)
+    def read(self, offset, size):
+        "Copy of a (small) slice at a file offset, e.g. for a header"
+        return self.data[offset:offset + size]
+    def unpack(self, fmt, offset):
+        "struct.unpack_from() at a file offset; fmt is a format or a Struct"
+        if isinstance(fmt, struct.Struct):
+            return fmt.unpack_from(self.data, offset)
+        return struct.unpack_from(fmt, self.data, offset)
+    def offset_of(self, address):
+        if self.base is None:
+            raise ValueError('image base address is not known')
+        return address - self.base
+    def contains(self, address):
+        return 0 <= self.offset_of(address) < len(self.data)
+    def at(self, address, size=None):
+        "Zero-copy slice at an address in the image's address space"
+        return self.view(self.offset_of(address), size)
+# EOF
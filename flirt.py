@@ -0,0 +1,389 @@
+"""
+IDA FLIRT .pat signatures, outside of IDA.
+
+A .pat line is: the first 32 bytes of a function in hex with ".." for
+variable bytes, the length and CRC16 of the bytes that follow, the
+function length, its names (":offset name", ":offset@ name" for local
+ones), referenced names ("^offset name") and the bytes after the CRC'd
+span. The file ends with "---".
+
+Code is assumed to be MIPS: functions start on 4-byte boundaries, so
+patterns are found through a fixed 32-bit word of theirs looked up in
+a hash table while walking the words of the object once.
+
+Patterns are made from a symbol list ("address name" lines) and an
+unpacked object, wildcarding what the linker fills in on R3900 code:
+jal/j targets, gp-relative offsets, and lui/low-half address pairs.
+"""
+
+import argparse
+import array
+import hashlib
+import json
+import os.path
+import re
+import sys
+import zynos
+
+def _crc16_table():
+    table = []
+    for value in xrange(256):
+        for i in xrange(8):
+            value = (value >> 1) ^ 0x8408 if value & 1 else value >> 1
+        table.append(value)
+    return table
+_CRC16_TABLE = _crc16_table()
+
+def crc16(data):
+    "The CRC16 FLAIR uses: X.25 with the bytes of the result swapped"
+    if not data:
+        return 0
+    crc = 0xFFFF
+    for c in bytearray(data):
+        crc = (crc >> 8) ^ _CRC16_TABLE[(crc ^ c) & 0xFF]
+    crc = ~crc & 0xFFFF
+    return (crc << 8 | crc >> 8) & 0xFFFF
+
+# Words too common in MIPS code to look patterns up by: nop, "jr ra".
+COMMON_WORDS = frozenset([0x00000000, 0x03E00008])
+
+class Pattern(object):
+    "One .pat line"
+
+    def __init__(self, head, crc_length, crc, length, names, refs=(), tail=''):
+        self.head = head
+        self.crc_length = crc_length
+        self.crc = crc
+        self.length = length
+        # [(offset, name, is_local)]
+        self.names = names
+        self.refs = list(refs)
+        self.tail = tail
+        self.head_re = hex_regex(head)
+        self.tail_re = hex_regex(tail)
+    def __str__(self):
+        fields = [self.head, '%02X' % self.crc_length, '%04X' % self.crc, '%04X' % self.length]
+        for offset, name, is_local in self.names:
+            fields.append(':%04X%s %s' % (offset, '@' if is_local else '', name))
+        for offset, name in self.refs:
+            fields.append('^%04X %s' % (offset, name))
+        if self.tail:
+            fields.append(self.tail)
+        return ' '.join(fields)
+    def words(self):
+        "(offset, value) of the fully fixed 32-bit words in the head"
+        for offset in xrange(0, len(self.head) // 8 * 4, 4):
+            text = self.head[offset * 2:offset * 2 + 8]
+            if '.' not in text:
+                yield offset, int(text, 16)
+    def match(self, data, start):
+        "Whether the function at start in data matches"
+        if start + self.length > len(data) or not self.head_re.match(data, start):
+            return False
+        span = start + 32
+        if self.crc_length and crc16(data[span:span + self.crc_length]) != self.crc:
+            return False
+        return not self.tail or bool(self.tail_re.match(data, span + self.crc_length))
+
+def hex_regex(text):
+    "A regex for bytes in hex with '..' as wildcards"
+    return re.compile(''.join('.' if text[i:i + 2] == '..' else re.escape(chr(int(text[i:i + 2], 16)))
+        for i in xrange(0, len(text) - 1, 2)), re.DOTALL)
+
+def _offset(text):
+    return -int(text[1:], 16) if text.startswith('-') else int(text, 16)
+
+def parse_pattern(line):
+    "Parse one .pat line; raises ValueError if it is not one"
+    fields = line.split()
+    if len(fields) < 5:
+        raise ValueError("too few fields")
+    head, crc_length, crc, length = fields[0], int(fields[1], 16), int(fields[2], 16), int(fields[3], 16)
+    if not re.match(r'^([0-9A-Fa-f]{2}|\.\.)*$', head):
+        raise ValueError("bad pattern '%s'" % fields[0])
+    names = []
+    refs = []
+    tail = ''
+    i = 4
+    while i < len(fields):
+        field = fields[i]
+        if field[0] in ':^' and i + 1 < len(fields):
+            if field[0] == ':':
+                is_local = field.endswith('@')
+                names.append((_offset(field[1:].rstrip('@')), fields[i + 1], is_local))
+            else:
+                refs.append((_offset(field[1:]), fields[i + 1]))
+            i += 2
+        elif i == len(fields) - 1:
+            tail = field
+            i += 1
+        else:
+            raise ValueError("unexpected '%s'" % field)
+    return Pattern(head, crc_length, crc, length, names, refs, tail)
+
+def read_pat(path):
+    "Patterns of a .pat file"
+    patterns = []
+    with open(path, 'r') as fp:
+        for number, line in enumerate(fp, 1):
+            line = line.strip()
+            if line == '---':
+                break
+            if not line:
+                continue
+            try:
+                patterns.append(parse_pattern(line))
+            except ValueError as e:
+                raise ValueError("%s:%d: %s" % (path, number, e))
+    return patterns
+
+class Matcher(object):
+    """
+    Patterns by one of their fixed words, the one rarest among all the
+    patterns; the few with no usable word are tried everywhere
+    """
+
+    def __init__(self, patterns):
+        counts = {}
+        for pattern in patterns:
+            for offset, word in pattern.words():
+                counts[word] = counts.get(word, 0) + 1
+        self.table = {}
+        self.unanchored = []
+        for pattern in patterns:
+            words = [(counts[word], offset, word) for offset, word in pattern.words() if word not in COMMON_WORDS]
+            if words:
+                count, offset, word = min(words)
+                self.table.setdefault(word, []).append((offset, pattern))
+            else:
+                self.unanchored.append(pattern)
+    def scan(self, data):
+        "(offset, pattern) of every match in data, in offset order"
+        # Pattern bytes are in memory order, so are the words they are
+        # looked up by, whatever the byte order of the code.
+        words = array.array('I', data[:len(data) & ~3])
+        if sys.byteorder == 'little':
+            words.byteswap()
+        table = self.table
+        matches = []
+        for index, word in enumerate(words):
+            if word in table:
+                position = index * 4
+                for offset, pattern in table[word]:
+                    if position >= offset and pattern.match(data, position - offset):
+                        matches.append((position - offset, pattern))
+        if self.unanchored:
+            for start in xrange(0, len(data), 4):
+                for pattern in self.unanchored:
+                    if pattern.match(data, start):
+                        matches.append((start, pattern))
+        matches.sort(key=lambda m: m[0])
+        return matches
+
+def names(matches, base=0):
+    "Public names to addresses, from scan() results"
+    result = {}
+    for start, pattern in matches:
+        for offset, name, is_local in pattern.names:
+            if not is_local:
+                result.setdefault(name, [])
+                if base + start + offset not in result[name]:
+                    result[name].append(base + start + offset)
+    return result
+
+def object_base(object_path):
+    "Where a RAM object of a zynos.py unpack tree is loaded, from the .map next to it"
+    name = os.path.basename(object_path)
+    for mme in zynos.read_map(os.path.join(os.path.dirname(object_path), '.map')):
+        if mme.name == name and mme.type1 & 0x80:
+            return mme.address
+    raise ValueError("no RAM object '%s' in the memory map" % name)
+
+# Upper halves of kseg0/kseg1 addresses, as loaded by lui.
+ADDRESS_HIGH = (0x8000, 0xBFFF)
+GP = 28
+# Opcodes taking an immediate offset or value from rs: addi, addiu,
+# ori, then loads and stores.
+IMMEDIATE_OPS = frozenset([0x08, 0x09, 0x0D] + range(0x20, 0x27) + range(0x28, 0x2F) + [0x31, 0x35, 0x39, 0x3D])
+# Those of them writing rt with a register value.
+WRITING_OPS = frozenset([0x08, 0x09, 0x0D] + range(0x20, 0x27))
+
+def mips_wildcards(code, address, endianness='be'):
+    """
+    The hex text of code with the relocated bytes as '..', and the
+    (offset, target) of its jal/j instructions
+    """
+    words = array.array('I', code[:len(code) & ~3])
+    if (endianness == 'be') == (sys.byteorder == 'little'):
+        words.byteswap()
+    # Byte masks of a word in memory order.
+    shifts = (24, 16, 8, 0) if endianness == 'be' else (0, 8, 16, 24)
+    text = []
+    calls = []
+    # Registers holding the upper half of an address.
+    high = set()
+    for index, word in enumerate(words):
+        op, rs, rt = word >> 26, word >> 21 & 31, word >> 16 & 31
+        mask = 0
+        if op in (2, 3):
+            mask = 0x00FFFFFF
+            calls.append((index * 4, (address + index * 4 + 4) & 0xF0000000 | (word & 0x03FFFFFF) << 2))
+        elif op == 0x0F:
+            if ADDRESS_HIGH[0] <= word & 0xFFFF <= ADDRESS_HIGH[1]:
+                mask = 0xFFFF
+                high.add(rt)
+            else:
+                high.discard(rt)
+        elif op in IMMEDIATE_OPS:
+            if rs == GP or rs in high:
+                mask = 0xFFFF
+            if op in WRITING_OPS:
+                high.discard(rt)
+        elif op == 0 and word & 0x3F in (8, 9):
+            high.clear()
+        for shift in shifts:
+            text.append('..' if mask >> shift & 0xFF else '%02X' % (word >> shift & 0xFF))
+    text.extend('%02X' % ord(c) for c in code[len(code) & ~3:])
+    return ''.join(text), calls
+
+def make_pattern(code, address, name, symbols=None, endianness='be'):
+    "The Pattern of the function code loaded at address"
+    text, calls = mips_wildcards(code, address, endianness)
+    head = text[:64].ljust(64, '.')
+    rest = text[64:]
+    wildcard = rest.find('..')
+    # Both ends of a byte are even offsets in the text.
+    crc_length = min(255, len(rest) // 2 if wildcard < 0 else wildcard // 2)
+    crc = crc16(code[32:32 + crc_length])
+    symbols = symbols or {}
+    refs = [(offset, symbols[target]) for offset, target in calls if target in symbols and target != address]
+    return Pattern(head, crc_length, crc, len(code), [(0, name, False)], refs, rest[crc_length * 2:])
+
+def read_symbols(path):
+    "{address: name} from a file of 'address name' lines"
+    symbols = {}
+    with open(path, 'r') as fp:
+        for number, line in enumerate(fp, 1):
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            try:
+                address, name = fields
+                symbols[int(address, 16)] = name
+            except ValueError:
+                raise ValueError("%s:%d: expected 'address name'" % (path, number))
+    return symbols
+
+def object_patterns(data, base, symbols, endianness='be'):
+    "Patterns of the functions of an object, each running up to the next symbol"
+    addresses = sorted(a for a in symbols if base <= a < base + len(data))
+    patterns = []
+    for address, end in zip(addresses, addresses[1:] + [base + len(data)]):
+        if end - address >= 4:
+            code = data[address - base:end - base]
+            patterns.append(make_pattern(code, address, symbols[address], symbols, endianness))
+    return patterns
+
+class PatternIndex(object):
+    """
+    Patterns by a hash of their bytes and public names, so that the
+    same function seen in many images is kept once
+    """
+
+    def __init__(self):
+        self.patterns = []
+        self.keys = set()
+        self.duplicates = 0
+    def key(self, pattern):
+        names = ' '.join(name for offset, name, is_local in pattern.names if not is_local)
+        text = ' '.join([pattern.head, '%02X' % pattern.crc_length, '%04X' % pattern.crc,
+            '%04X' % pattern.length, pattern.tail, names])
+        return hashlib.sha1(text).digest()
+    def add(self, pattern):
+        "Whether pattern was new"
+        key = self.key(pattern)
+        if key in self.keys:
+            self.duplicates += 1
+            return False
+        self.keys.add(key)
+        self.patterns.append(pattern)
+        return True
+    def write(self, path):
+        with open(path, 'w') as fp:
+            for pattern in self.patterns:
+                fp.write('%s\n' % pattern)
+            fp.write('---\n')
+
+def do_match(args):
+    patterns = []
+    for path in args.pat:
+        patterns.extend(read_pat(path))
+    if args.base is None:
+        args.base = object_base(args.object)
+    with open(args.object, 'rb') as fp:
+        data = fp.read()
+    found = names(Matcher(patterns).scan(data), args.base)
+    if args.json:
+        json.dump(found, sys.stdout, indent=1, sort_keys=True)
+        print
+    else:
+        for address, name in sorted((a, n) for n, addresses in found.iteritems() for a in addresses):
+            print "%08X %s" % (address, name)
+
+def do_generate(args):
+    if len(args.inputs) % 2:
+        raise ValueError("expected object and symbol list pairs")
+    index = PatternIndex()
+    if os.path.exists(args.output):
+        for pattern in read_pat(args.output):
+            index.add(pattern)
+        print "%d patterns in '%s'" % (len(index.patterns), args.output)
+    for object_path, symbols_path in zip(args.inputs[::2], args.inputs[1::2]):
+        base = args.base if args.base is not None else object_base(object_path)
+        with open(object_path, 'rb') as fp:
+            data = fp.read()
+        patterns = object_patterns(data, base, read_symbols(symbols_path), args.endianness)
+        added = sum(index.add(pattern) for pattern in patterns)
+        print "%s: %d functions, %d new patterns" % (object_path, len(patterns), added)
+    index.write(args.output)
+    print "%d patterns written to '%s', %d duplicates dropped" % (len(index.patterns), args.output, index.duplicates)
+
+def num(x):
+    return int(x, 0)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers()
+
+    parser_match = subparsers.add_parser('match', help='find the functions of .pat files in a code object')
+    parser_match.add_argument('object',
+        help='decompressed object, e.g. RasCode from zynos.py unpack')
+    parser_match.add_argument('pat',
+        nargs='+')
+    parser_match.add_argument('--base',
+        type=num,
+        default=None,
+        help='load address of the object (default: from the .map next to it)')
+    parser_match.add_argument('--json',
+        action='store_true',
+        help='print the name to addresses map as JSON')
+    parser_match.set_defaults(do=do_match)
+
+    parser_generate = subparsers.add_parser('generate', help='make or extend a .pat file from objects and their symbols')
+    parser_generate.add_argument('output',
+        help='.pat file; patterns already in it are kept')
+    parser_generate.add_argument('inputs',
+        nargs='+',
+        metavar='object symbols',
+        help="decompressed object and a file of its 'address name' lines, repeated for each image")
+    parser_generate.add_argument('--base',
+        type=num,
+        default=None,
+        help='load address of the objects (default: from the .map next to each)')
+    parser_generate.add_argument('--endianness',
+        choices=('be', 'le'),
+        default='be')
+    parser_generate.set_defaults(do=do_generate)
+
+    args = parser.parse_args()
+    args.do(args)
@@ -1,115 +1,390 @@
-import collections
+import struct
+import sys
+import time
 
-# Copied from:
+# Decoder originally based on:
 # https://gist.github.com/FiloSottile/4663892
-# with a few modifications.
+# reworked to run off a bit accumulator and lookup tables.
 
-class BitReader:
+# Length field lookup, indexed by the next 4 bits of the stream:
+# (match length, bits consumed); None marks the extended form
+# (1111 followed by nibbles). As in Stac LZS, 1100..1110 are 5..7; the
+# original gist read them as 17..19.
+_LENGTH_CODES = tuple(
+    [(2, 2)] * 4 + [(3, 2)] * 4 + [(4, 2)] * 4 +
+    [(5, 4), (6, 4), (7, 4), (None, 4)])
+
+# Masks to keep the accumulator trimmed to the bits not consumed yet.
+_MASKS = tuple((1 << n) - 1 for n in range(64))
+
+class Window:
     """
-    Gets a string or a iterable of chars (also mmap)
-    representing bytes (ord) and permits to extract
-    bits one by one like a stream
+    Fixed-size circular buffer holding the last bytes
+    produced, the history back references of the next
+    block can reach; one instance is shared by all the
+    blocks of a stream. Matches themselves are copied
+    in the decoder's output buffer
     """
-    def __init__(self, bytes):
-        self._bits = collections.deque()
-        
-        for byte in bytes:
-            byte = ord(byte)
-            for n in xrange(8):
-                self._bits.append(bool((byte >> (7-n)) & 1))
-            
-    def getBit(self):
-        return self._bits.popleft()
-        
-    def getBits(self, num):
-        res = 0
-        for i in xrange(num):
-            res += self.getBit() << num-1-i
-        return res
-        
-    def getByte(self):
-        return self.getBits(8)
-        
+    def __init__(self, size=2048):
+        self.size = size
+        self.buffer = bytearray(size)
+        self.cursor = 0
+        self.filled = 0
+
+    def write(self, data):
+        """Append bytes; only the last `size` of them are kept"""
+        size = self.size
+        if len(data) >= size:
+            self.buffer[:] = data[len(data) - size:]
+            self.cursor = 0
+            self.filled = size
+            return
+        cursor = self.cursor
+        head = min(len(data), size - cursor)
+        self.buffer[cursor:cursor + head] = data[:head]
+        self.buffer[:len(data) - head] = data[head:]
+        self.cursor = (cursor + len(data)) % size
+        self.filled = min(self.filled + len(data), size)
+
+    def history(self):
+        """Return the window contents, oldest byte first"""
+        if self.filled < self.size:
+            return self.buffer[:self.cursor]
+        return self.buffer[self.cursor:] + self.buffer[:self.cursor]
+
     def __len__(self):
-        return len(self._bits)
-        
-class RingList:
-    """
-    When the list is full, for every item appended
-    the older is removed
-    """
-    def __init__(self, length):
-        self.__data__ = collections.deque()
-        self.__full__ = False
-        self.__max__ = length
-
-    def append(self, x):
-        if self.__full__:
-            self.__data__.popleft()
-        self.__data__.append(x)
-        if self.size() == self.__max__:
-            self.__full__ = True
-
-    def get(self):
-        return self.__data__
-
-    def size(self):
-        return len(self.__data__)
-
-    def maxsize(self):
-        return self.__max__
-        
-    def __getitem__(self, n):
-        if n >= self.size():
-            return None
-        return self.__data__[n]
-        
-def decompress(data, window):
+        return self.filled
+
+# Compressed input is decoded in slices of this size, so mmaps and
+# other big buffers are never copied as a whole.
+_FEED_SIZE = 0x10000
+
+class Decompressor:
     """
-    Gets a string or a iterable of chars (also mmap)
-    representing bytes (ord) and an optional
-    pre-populated dictionary; return the decompressed
-    string and the final dictionary
+    Incremental decoder: feed() it the compressed data
+    in chunks of any size, get back the output those
+    chunks complete; the bit position and the window
+    are kept between the calls
     """
-    reader = BitReader(data)
-    result = ''
-    
-    while True:
-        bit = reader.getBit()
-        if not bit:
-            char = reader.getByte()
-            result += chr(char)
-            window.append(char)
-        else:
-            bit = reader.getBit()
-            if bit:
-                offset = reader.getBits(7)
+    def __init__(self, window=None):
+        self.window = window if window is not None else Window()
+        self.eof = False
+        self.unused_data = b''
+        self._pending = bytearray()
+        self._acc = 0
+        self._bits = 0
+
+    def feed(self, data):
+        """
+        Gets a string or a buffer (also mmap, bytearray);
+        return the decompressed string available so far
+        """
+        # Always sliced, as an mmap only gives its bytes that way.
+        if self.eof:
+            self.unused_data += bytes(bytearray(data[:]))
+            return b''
+        parts = []
+        for offset in range(0, len(data), _FEED_SIZE):
+            parts.append(self._decode(data[offset:offset + _FEED_SIZE]))
+            if self.eof:
+                self.unused_data += bytes(bytearray(data[offset + _FEED_SIZE:]))
+                break
+        return b''.join(parts)
+
+    def _decode(self, data):
+        src = self._pending
+        src += data
+        src_length = len(src)
+        src_pos = 0
+        acc = self._acc
+        bits = self._bits
+        masks = _MASKS
+        length_codes = _LENGTH_CODES
+
+        # Output goes after the window contents, so back references
+        # reaching into the previous block are plain slice copies.
+        window = self.window
+        history = window.history()
+        start = len(history)
+        out = history + bytearray(max(4 * src_length, 0x1000))
+        out_size = len(out)
+        pos = start
+
+        while True:
+            token_pos = src_pos
+            token_acc = acc
+            token_bits = bits
+            if bits < 25:
+                # Refill; the longest fixed part of a token is 1+1+11+4 bits.
+                while bits < 25 and src_pos < src_length:
+                    acc = (acc << 8) | src[src_pos]
+                    src_pos += 1
+                    bits += 8
+                if bits < 9:
+                    break
+            bits -= 1
+            if not (acc >> bits) & 1:
+                bits -= 8
+                if pos == out_size:
+                    out.extend(bytearray(out_size))
+                    out_size += out_size
+                out[pos] = (acc >> bits) & 0xFF
+                pos += 1
+                acc &= masks[bits]
+                continue
+
+            bits -= 1
+            if (acc >> bits) & 1:
+                bits -= 7
+                offset = (acc >> bits) & 0x7F
                 if offset == 0:
                     # EOF
+                    self.eof = True
                     break
             else:
-                offset = reader.getBits(11)
-            
-            lenField = reader.getBits(2)
-            if lenField < 3:
-                lenght = lenField + 2
+                if bits < 11:
+                    break
+                bits -= 11
+                offset = (acc >> bits) & 0x7FF
+
+            if bits >= 4:
+                length, used = length_codes[(acc >> (bits - 4)) & 0xF]
+            elif bits >= 2 and (acc >> (bits - 2)) & 3 != 3:
+                length, used = length_codes[((acc >> (bits - 2)) & 3) << 2]
             else:
-                lenField <<= 2
-                lenField += reader.getBits(2)
-                if lenField < 15:
-                    lenght = (lenField & 0x0f) + 5
-                else:
-                    lenCounter = 0
-                    lenField = reader.getBits(4)
-                    while lenField == 15:
-                        lenField = reader.getBits(4)
-                        lenCounter += 1
-                    lenght = 15*lenCounter + 8 + lenField
-            
-            for i in xrange(lenght):
-                char = window[-offset]
-                result += chr(char)
-                window.append(char)
-    
+                break
+            bits -= used
+            acc &= masks[bits]
+            if length is None:
+                length = 8
+                while True:
+                    if bits < 4:
+                        while bits < 25 and src_pos < src_length:
+                            acc = (acc << 8) | src[src_pos]
+                            src_pos += 1
+                            bits += 8
+                        if bits < 4:
+                            length = None
+                            break
+                    bits -= 4
+                    nibble = (acc >> bits) & 0xF
+                    acc &= masks[bits]
+                    length += nibble
+                    if nibble != 15:
+                        break
+                if length is None:
+                    break
+
+            src_start = pos - offset
+            if offset == 0 or src_start < 0:
+                raise ValueError('LZS offset %d points before the window start' % offset)
+            if pos + length > out_size:
+                out.extend(bytearray(max(out_size, length)))
+                out_size = len(out)
+            if offset >= length:
+                out[pos:pos + length] = out[src_start:src_start + length]
+            else:
+                # Overlapping copy: the last `offset` bytes repeat.
+                pattern = out[src_start:pos]
+                out[pos:pos + length] = (pattern * (length // offset + 1))[:length]
+            pos += length
+
+        if self.eof:
+            # The rest of the current byte is padding; whole bytes
+            # already in the accumulator belong to the trailing data.
+            self.unused_data = bytes(src[src_pos - bits // 8:])
+            self._pending = bytearray()
+        else:
+            # Ran out of input mid-token: rewind to the token start and
+            # keep only the partially consumed byte in the accumulator.
+            whole = token_bits // 8
+            self._pending = src[token_pos - whole:]
+            self._acc = token_acc >> (8 * whole)
+            self._bits = token_bits - 8 * whole
+
+        window.write(out[max(start, pos - window.size):pos])
+        return bytes(out[start:pos])
+
+def decompress(data, window=None):
+    """
+    Gets a string or a buffer (also mmap, bytearray)
+    representing the compressed bytes and an optional
+    pre-populated Window; return the decompressed
+    string, the window is updated in place
+    """
+    decompressor = Decompressor(window)
+    result = decompressor.feed(data)
+    if not decompressor.eof:
+        raise ValueError('LZS stream ended without an end marker')
     return result
+
+def decompress_stream(source, window=None, chunk_size=_FEED_SIZE):
+    """
+    Gets a file-like object or a buffer (also mmap);
+    yield the decompressed data piece by piece, up to
+    the end marker
+    """
+    decompressor = Decompressor(window)
+    if hasattr(source, 'read'):
+        chunks = iter(lambda: source.read(chunk_size), b'')
+    else:
+        chunks = (source[offset:offset + chunk_size] for offset in range(0, len(source), chunk_size))
+    for chunk in chunks:
+        result = decompressor.feed(chunk)
+        if result:
+            yield result
+        if decompressor.eof:
+            return
+    raise ValueError('LZS stream ended without an end marker')
+
+class BitWriter:
+    """
+    Collects bits MSB first and packs them into bytes
+    """
+    def __init__(self):
+        self.data = bytearray()
+        self._acc = 0
+        self._bits = 0
+
+    def put(self, value, count):
+        acc = (self._acc << count) | value
+        bits = self._bits + count
+        while bits >= 8:
+            bits -= 8
+            self.data.append((acc >> bits) & 0xFF)
+        self._acc = acc & _MASKS[bits]
+        self._bits = bits
+
+    def flush(self):
+        """Pad the last byte with zero bits and return the data"""
+        if self._bits:
+            self.put(0, 8 - self._bits)
+        return self.data
+
+def _build_length_encoding():
+    encoding = {}
+    for index, (length, used) in enumerate(_LENGTH_CODES):
+        if length is not None and length not in encoding:
+            encoding[length] = (index >> (4 - used), used)
+    return encoding
+
+# Match length -> (code, bits) for the lengths with a short code.
+_LENGTH_ENCODING = _build_length_encoding()
+
+# Compressor defaults: candidates checked per position and the match
+# length considered good enough to stop searching.
+DEFAULT_EFFORT = 16
+_NICE_LENGTH = 256
+
+def _put_match(writer, offset, length):
+    if offset < 128:
+        writer.put(0x180 | offset, 9)
+    else:
+        writer.put(0x1000 | offset, 13)
+    if length in _LENGTH_ENCODING:
+        writer.put(*_LENGTH_ENCODING[length])
+    else:
+        extra = length - 8
+        writer.put(0xF, 4)
+        while extra >= 15:
+            writer.put(0xF, 4)
+            extra -= 15
+        writer.put(extra, 4)
+
+def compress(data, window=None, effort=DEFAULT_EFFORT):
+    """
+    Gets a string or a buffer with the bytes to compress,
+    an optional Window shared with the previous blocks
+    and the effort level (hash chain candidates checked
+    per position); return the compressed string ending
+    with the end marker, the window is updated in place
+    """
+    if window is None:
+        window = Window()
+    history = window.history()
+    start = len(history)
+    buf = history + bytearray(data)
+    size = len(buf)
+    max_offset = min(window.size - 1, 0x7FF)
+
+    # Hash chains over 2-byte prefixes, the shortest encodable match.
+    head = {}
+    chain = [-1] * size
+    for i in range(start - 1):
+        key = (buf[i] << 8) | buf[i + 1]
+        chain[i] = head.get(key, -1)
+        head[key] = i
+
+    writer = BitWriter()
+    pos = start
+    while pos < size:
+        best_length = 1
+        best_offset = 0
+        if pos + 1 < size:
+            key = (buf[pos] << 8) | buf[pos + 1]
+            candidate = head.get(key, -1)
+            limit = size - pos
+            tries = effort
+            while candidate >= 0 and tries > 0 and pos - candidate <= max_offset:
+                tries -= 1
+                if best_length < limit and buf[candidate + best_length] == buf[pos + best_length]:
+                    length = 2
+                    while length + 32 <= limit and buf[candidate + length:candidate + length + 32] == buf[pos + length:pos + length + 32]:
+                        length += 32
+                    while length < limit and buf[candidate + length] == buf[pos + length]:
+                        length += 1
+                    if length > best_length:
+                        best_length = length
+                        best_offset = pos - candidate
+                        if length >= _NICE_LENGTH or length == limit:
+                            break
+                candidate = chain[candidate]
+
+        if best_length < 2:
+            writer.put(buf[pos], 9)
+        else:
+            _put_match(writer, best_offset, best_length)
+        next_pos = pos + best_length
+        while pos < next_pos and pos + 1 < size:
+            key = (buf[pos] << 8) | buf[pos + 1]
+            chain[pos] = head.get(key, -1)
+            head[key] = pos
+            pos += 1
+        pos = next_pos
+    writer.put(0x180, 9)
+
+    window.write(buf[max(start, size - window.size):])
+    return bytes(writer.flush())
+
+# Block framing used by rom-0 spt.dat: tag, compressed length, data.
+BLOCK_TAG = 0x0800
+
+def compress_blocks(data, window=None, block_size=0x800, effort=DEFAULT_EFFORT):
+    """
+    Split the data into blocks of `block_size` bytes
+    compressed with a shared window, each one prefixed
+    with a big-endian (BLOCK_TAG, length) header; return
+    the concatenated blocks
+    """
+    if window is None:
+        window = Window()
+    blocks = []
+    for offset in range(0, len(data), block_size):
+        block = compress(data[offset:offset + block_size], window, effort)
+        blocks.append(struct.pack('>HH', BLOCK_TAG, len(block)))
+        blocks.append(block)
+    return b''.join(blocks)
+
+if __name__ == '__main__':
+    # Throughput check: lzs.py <raw LZS stream> [rounds]
+    with open(sys.argv[1], 'rb') as fp:
+        data = fp.read()
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    started = time.time()
+    for i in range(rounds):
+        result = decompress(data, Window())
+    elapsed = time.time() - started
+    print("%d -> %d bytes, %.3f ms per round, %.1f KB/s of output" % (
+        len(data), len(result), 1000.0 * elapsed / rounds,
+        len(result) * rounds / elapsed / 1024.0))
 # EOF
@@ -0,0 +1,178 @@
+"""
+Reads fields at fixed offsets out of spt.dat, the configuration blob
+inside rom-0 files.
+
+Only the admin password slot is known to sit at a fixed place (0x14,
+as published with the rom-0 disclosure). The record layout of the rest
+is not known, so records are not split out and settings such as WAN or
+SNMP are not decoded. Fields found for a given firmware build can be
+described in a JSON layout file, {"name": [offset, size, kind], ...},
+with kind one of str, u8, u16, u32, ip or hex. The string index helps
+finding where they are.
+"""
+
+import argparse
+import bisect
+import csv
+import json
+import os
+import re
+import struct
+import sys
+from unrom0 import Rom0
+
+SPT_FIELDS = {
+    'admin_password': (0x14, 0x20, 'str'),
+}
+
+# Shorter runs of printable characters are not indexed.
+PRINTABLE = re.compile('[\x20-\x7e]{4,}')
+
+def decode_field(data, offset, size, kind):
+    raw = data[offset:offset + size]
+    if len(raw) < size:
+        return None
+    if kind == 'str':
+        return raw.split('\0', 1)[0]
+    if kind == 'u8':
+        return ord(raw[0])
+    if kind == 'u16':
+        return struct.unpack('>H', raw[:2])[0]
+    if kind == 'u32':
+        return struct.unpack('>I', raw[:4])[0]
+    if kind == 'ip':
+        return '.'.join(str(ord(c)) for c in raw[:4])
+    if kind == 'hex':
+        return raw.encode('hex')
+    raise ValueError("unknown field kind '%s'" % kind)
+
+def read_layout(path):
+    "Extra fields from a JSON layout file, checked"
+    with open(path, 'r') as fp:
+        layout = json.load(fp)
+    fields = {}
+    for name, spec in layout.iteritems():
+        offset, size, kind = spec
+        if kind not in ('str', 'u8', 'u16', 'u32', 'ip', 'hex'):
+            raise ValueError("%s: unknown kind '%s' for '%s'" % (path, kind, name))
+        fields[str(name)] = (int(offset), int(size), str(kind))
+    return fields
+
+class SptDat(object):
+    """
+    A decompressed spt.dat: fields are decoded through the layout,
+    strings through an index by offset built on first use
+    """
+
+    def __init__(self, data, layout=None):
+        self.data = data
+        self.layout = dict(SPT_FIELDS)
+        if layout:
+            self.layout.update(layout)
+        self._offsets = None
+        self._strings = None
+    def __len__(self):
+        return len(self.data)
+    def field(self, name):
+        offset, size, kind = self.layout[name]
+        return decode_field(self.data, offset, size, kind)
+    def fields(self):
+        return dict((name, self.field(name)) for name in self.layout)
+    def _index(self):
+        if self._offsets is None:
+            offsets = []
+            strings = []
+            for match in PRINTABLE.finditer(self.data):
+                offsets.append(match.start())
+                strings.append(match.group())
+            self._offsets = offsets
+            self._strings = strings
+    def strings(self, start=0, end=None):
+        "(offset, string) of the printable strings starting in start..end"
+        self._index()
+        lo = bisect.bisect_left(self._offsets, start)
+        hi = len(self._offsets) if end is None else bisect.bisect_left(self._offsets, end)
+        return zip(self._offsets[lo:hi], self._strings[lo:hi])
+    def find(self, text):
+        "Offsets of the indexed strings containing text"
+        self._index()
+        return [offset for offset, string in zip(self._offsets, self._strings) if text in string]
+
+def load(path, layout=None, raw=True):
+    "SptDat from a rom-0 file, or with raw from a file holding spt.dat itself"
+    rom0 = Rom0(path)
+    try:
+        if 'spt.dat' in rom0:
+            return SptDat(rom0['spt.dat'], layout)
+    finally:
+        rom0.close()
+    if not raw:
+        raise ValueError('no spt.dat entry')
+    with open(path, 'rb') as fp:
+        return SptDat(fp.read(), layout)
+
+def do_show(args):
+    spt = load(args.path, args.layout)
+    print "spt.dat: %d bytes" % len(spt)
+    for name, value in sorted(spt.fields().iteritems()):
+        print "%-20s %r" % (name, value)
+    if args.strings:
+        for offset, string in spt.strings():
+            print "%06X %s" % (offset, string)
+
+def escape(value):
+    "Strings with the unprintable bytes escaped, for the CSV"
+    if isinstance(value, str):
+        return value.encode('string_escape')
+    return value
+
+def do_batch(args):
+    names = sorted(SPT_FIELDS.keys() + (args.layout or {}).keys())
+    out = open(args.output, 'wb') if args.output else sys.stdout
+    try:
+        writer = csv.writer(out)
+        writer.writerow(['path', 'error', 'spt_length'] + names)
+        count = 0
+        for root, dirs, files in os.walk(args.input_dir):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                row = [os.path.relpath(path, args.input_dir)]
+                try:
+                    spt = load(path, args.layout, raw=False)
+                    values = spt.fields()
+                    row += ['', len(spt)] + [escape(values[n]) for n in names]
+                except Exception as e:
+                    row += [str(e) or e.__class__.__name__, ''] + [''] * len(names)
+                writer.writerow(row)
+                count += 1
+    finally:
+        if args.output:
+            out.close()
+    if args.output:
+        print "%d files summarized in '%s'." % (count, args.output)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--layout',
+        type=read_layout,
+        default=None,
+        help='JSON file describing fields at fixed offsets, beyond the admin password')
+    subparsers = parser.add_subparsers()
+
+    parser_show = subparsers.add_parser('show', help='print the admin password and layout fields of one rom-0 or spt.dat file')
+    parser_show.add_argument('path')
+    parser_show.add_argument('--strings',
+        action='store_true',
+        help='also list the strings and their offsets')
+    parser_show.set_defaults(do=do_show)
+
+    parser_batch = subparsers.add_parser('batch', help='tabulate the admin password and layout fields of a directory of rom-0 files as CSV')
+    parser_batch.add_argument('input_dir')
+    parser_batch.add_argument('--output',
+        default=None,
+        help='CSV file to write (default: standard output)')
+    parser_batch.set_defaults(do=do_batch)
+
+    args = parser.parse_args()
+    args.do(args)
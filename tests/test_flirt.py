@@ -0,0 +1,105 @@
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import flirt
+
+# From sig/tx_r3900_30f30b.pat, shortened.
+LINE = ('27BDFFE8AFBF0010AFA40018AFA5001C8F84....0C......00000000........ '
+    '0A 0000 003A :0000 _txe_queue_send :0010@ loop ^0014 _tx_queue_send '
+    '8FBF001027BD001803E0000800000000')
+
+class PatternTest(unittest.TestCase):
+
+    def test_crc16(self):
+        self.assertEqual(flirt.crc16('123456789'), 0x6E90)
+        self.assertEqual(flirt.crc16(''), 0)
+
+    def test_parse(self):
+        pattern = flirt.parse_pattern(LINE)
+        self.assertEqual(pattern.crc_length, 10)
+        self.assertEqual(pattern.length, 0x3A)
+        self.assertEqual(pattern.names, [(0, '_txe_queue_send', False), (0x10, 'loop', True)])
+        self.assertEqual(pattern.refs, [(0x14, '_tx_queue_send')])
+        self.assertEqual(str(pattern), LINE)
+        self.assertEqual(list(pattern.words())[:2], [(0, 0x27BDFFE8), (4, 0xAFBF0010)])
+        self.assertRaises(ValueError, flirt.parse_pattern, 'XYZ 00 0000 0010 :0000 f')
+
+def function(pattern, crc_span, filler='\x5a'):
+    "Bytes matching pattern, with its wildcards and the CRC'd span filled in"
+    head = ''.join(filler if pattern.head[i:i + 2] == '..' else chr(int(pattern.head[i:i + 2], 16))
+        for i in xrange(0, len(pattern.head), 2))
+    tail = pattern.tail.decode('hex')
+    return head + crc_span + tail
+
+class MatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.span = 'ABCDEFGHIJ'
+        line = LINE.replace(' 0A 0000 ', ' 0A %04X ' % flirt.crc16(self.span))
+        self.pattern = flirt.parse_pattern(line)
+        self.code = function(self.pattern, self.span)
+        self.assertEqual(len(self.code), self.pattern.length)
+
+    def test_scan(self):
+        # At 0x100, then at 0x200 with other bytes in the wildcards.
+        data = '\0' * 0x100 + self.code.ljust(0x100, '\x11') + function(self.pattern, self.span, '\xa5') + '\0' * 0x40
+        matches = flirt.Matcher([self.pattern]).scan(data)
+        self.assertEqual([start for start, pattern in matches], [0x100, 0x200])
+        self.assertEqual(flirt.names(matches, 0x80000000), {'_txe_queue_send': [0x80000100, 0x80000200]})
+
+    def test_no_match(self):
+        matcher = flirt.Matcher([self.pattern])
+        # Wrong CRC'd span, wrong tail, cut short.
+        self.assertEqual(matcher.scan(function(self.pattern, 'ABCDEFGHIK')), [])
+        self.assertEqual(matcher.scan(self.code[:-1] + '\x01'), [])
+        self.assertEqual(matcher.scan(self.code[:0x30]), [])
+
+    def test_little_endian(self):
+        # Pattern bytes are in memory order, for little-endian code too.
+        pattern = flirt.parse_pattern(LINE.replace('27BDFFE8AFBF0010', 'E8FFBD271000BFAF'))
+        code = function(pattern, '')
+        pattern = flirt.Pattern(pattern.head, 0, 0, len(code), pattern.names, tail=pattern.tail)
+        self.assertEqual([start for start, p in flirt.Matcher([pattern]).scan('\0' * 8 + code)], [8])
+
+def mips(*words):
+    return struct.pack('>%dI' % len(words), *words)
+
+class GenerateTest(unittest.TestCase):
+
+    def setUp(self):
+        # addiu sp; jal; lw v1 from gp; lui a0 with an address, then its low half; jr ra
+        self.code = mips(0x27BDFFE0, 0x0C000000 | 0x80010040 >> 2 & 0x03FFFFFF, 0x8F830123,
+            0x3C048012, 0x24840456, 0x3C041234, 0x24840001, 0x03E00008, 0x27BD0020)
+
+    def test_wildcards(self):
+        text, calls = flirt.mips_wildcards(self.code, 0x80010000)
+        self.assertEqual(text, '27BDFFE00C......8F83....3C04....2484....3C04123424840001' '03E0000827BD0020')
+        self.assertEqual(calls, [(4, 0x80010040)])
+        text, calls = flirt.mips_wildcards(struct.pack('<I', 0x8F830123), 0, 'le')
+        self.assertEqual(text, '....838F')
+
+    def test_round_trip(self):
+        symbols = {0x80010000: 'first', 0x80010040: 'second'}
+        second = mips(0x27BDFFD8) + self.code[4:]
+        other = self.code.replace(mips(0x8F830123), mips(0x8F83BEEF)).ljust(0x40, '\0') + second + '\0' * 16
+        patterns = flirt.object_patterns(other, 0x80010000, symbols)
+        self.assertEqual([p.length for p in patterns], [0x40, len(self.code) + 16])
+        self.assertEqual(patterns[0].refs, [(4, 'second')])
+        # The same functions elsewhere, with other addresses in the relocated fields.
+        moved = self.code.ljust(0x40, '\0') + second.replace(mips(0x3C048012), mips(0x3C048034)) + '\0' * 16
+        found = flirt.names(flirt.Matcher(patterns).scan('\xff' * 0x100 + moved), 0x80020000)
+        self.assertEqual(found, {'first': [0x80020100], 'second': [0x80020140]})
+
+    def test_index(self):
+        index = flirt.PatternIndex()
+        patterns = flirt.object_patterns(self.code, 0x80010000, {0x80010000: 'first'})
+        again = flirt.object_patterns(self.code, 0x80020000, {0x80020000: 'first'})
+        renamed = flirt.object_patterns(self.code, 0x80020000, {0x80020000: 'other'})
+        self.assertEqual([index.add(p) for p in patterns + again + renamed], [True, False, True])
+        self.assertEqual(index.duplicates, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import mmap
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lzs
+
+class BitsTest(unittest.TestCase):
+    "Hand-made streams, checked against Stac LZS"
+
+    def stream(self, *fields):
+        writer = lzs.BitWriter()
+        for value, count in fields:
+            writer.put(value, count)
+        return bytes(writer.flush())
+
+    def test_short_lengths(self):
+        # 'ab', then a match 2 back with each short length code.
+        for code, bits, length in ((0, 2, 2), (1, 2, 3), (2, 2, 4), (0xC, 4, 5), (0xD, 4, 6), (0xE, 4, 7)):
+            data = self.stream((ord('a'), 9), (ord('b'), 9), (0x182, 9), (code, bits), (0x180, 9))
+            self.assertEqual(lzs.decompress(data), 'ab' + ('ab' * 4)[:length])
+
+    def test_extended_lengths(self):
+        for nibbles, length in (([0], 8), ([14], 22), ([15, 0], 23), ([15, 15, 3], 41)):
+            fields = [(ord('x'), 9), (0x181, 9), (0xF, 4)] + [(n, 4) for n in nibbles] + [(0x180, 9)]
+            self.assertEqual(lzs.decompress(self.stream(*fields)), 'x' * (length + 1))
+
+class RoundTripTest(unittest.TestCase):
+
+    def check(self, data, **kw):
+        compressed = lzs.compress(data, **kw)
+        self.assertEqual(lzs.decompress(compressed), data)
+        return compressed
+
+    def test_match_lengths(self):
+        for length in range(2, 40):
+            self.check('0123456789' + 'x' * length + '-' + '0123456789'[:min(length, 10)] + 'x' * length)
+
+    def test_one_token_per_match(self):
+        # 'abcdefg', then a 7-byte match: 7 literals, one 9-bit offset
+        # and a 4-bit length, the end marker.
+        self.assertEqual(len(self.check('abcdefg' * 2)), (7 * 9 + 9 + 4 + 9 + 7) // 8)
+
+    def test_random(self):
+        r = random.Random(1)
+        for alphabet in ('ab', 'abcdefgh', ''.join(chr(i) for i in range(256))):
+            self.check(''.join(r.choice(alphabet) for i in xrange(5000)))
+
+    def test_blocks(self):
+        r = random.Random(2)
+        data = ''.join(r.choice('abc ') for i in xrange(10000))
+        blocks = lzs.compress_blocks(data)
+        window = lzs.Window()
+        output = []
+        offset = 0
+        while offset < len(blocks):
+            tag, length = struct.unpack('>HH', blocks[offset:offset + 4])
+            self.assertEqual(tag, lzs.BLOCK_TAG)
+            output.append(lzs.decompress(blocks[offset + 4:offset + 4 + length], window))
+            offset += 4 + length
+        self.assertEqual(''.join(output), data)
+
+class StreamTest(unittest.TestCase):
+
+    def setUp(self):
+        r = random.Random(6)
+        # Barely compressible, so the stream is over one slice of input.
+        self.data = ''.join(r.choice('abcd  ') + chr(r.randrange(256)) for i in xrange(0x9000))
+        self.compressed = lzs.compress(self.data)
+        self.dir = tempfile.mkdtemp()
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_chunked_feed(self):
+        for size in (1, 3, 7, 0x1000, 0x10001):
+            decompressor = lzs.Decompressor()
+            output = []
+            for offset in xrange(0, len(self.compressed), size):
+                output.append(decompressor.feed(self.compressed[offset:offset + size]))
+            self.assertTrue(decompressor.eof)
+            self.assertEqual(''.join(output), self.data)
+
+    def test_unused_data(self):
+        decompressor = lzs.Decompressor()
+        self.assertEqual(decompressor.feed(self.compressed + 'tail'), self.data)
+        decompressor.feed('more')
+        self.assertEqual(decompressor.unused_data, 'tailmore')
+
+    def test_mmap(self):
+        # Both below and above the size fed in one slice.
+        for data in (self.data[:0x2000], self.data):
+            path = os.path.join(self.dir, 'lzs.bin')
+            with open(path, 'wb') as fp:
+                fp.write(lzs.compress(data) + 'tail')
+            with open(path, 'rb') as fp:
+                m = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    self.assertEqual(lzs.decompress(m), data)
+                    self.assertEqual(''.join(lzs.decompress_stream(m)), data)
+                    decompressor = lzs.Decompressor()
+                    decompressor.feed(m)
+                    decompressor.feed(m)
+                    self.assertEqual(decompressor.unused_data, 'tail' + open(path, 'rb').read())
+                finally:
+                    m.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'zyxel'))
+from flashimage import Image
+import nand
+
+def parity(value):
+    return bin(value).count('1') & 1
+
+def reference_ecc(block):
+    "nand_calculate_ecc() of Linux, bit by bit"
+    columns = 0
+    lines = 0
+    complements = 0
+    for index, c in enumerate(bytearray(block)):
+        for i, mask in enumerate((0x55, 0xAA, 0x33, 0xCC, 0x0F, 0xF0)):
+            columns ^= parity(c & mask) << i
+        if parity(c):
+            lines ^= index
+            complements ^= ~index & 0xFF
+    # Line parity pairs, LP(2k+1) from the indexes and LP(2k) from their complements.
+    code = [0, 0]
+    for k in xrange(8):
+        bit = 7 - k
+        pair = (lines >> bit & 1) << 1 | (complements >> bit & 1)
+        code[k // 4] |= pair << (6 - 2 * (k % 4))
+    return chr(~code[0] & 0xFF) + chr(~code[1] & 0xFF) + chr(~columns << 2 & 0xFF | 3)
+
+class HammingTest(unittest.TestCase):
+
+    def setUp(self):
+        r = random.Random(4)
+        self.blocks = [''.join(chr(r.randrange(256)) for i in xrange(nand.ECC_BLOCK)) for n in xrange(8)]
+        self.blocks += ['\0' * nand.ECC_BLOCK, '\xff' * nand.ECC_BLOCK]
+        self.random = r
+
+    def flip(self, data, byte, bit):
+        return data[:byte] + chr(ord(data[byte]) ^ 1 << bit) + data[byte + 1:]
+
+    def test_ecc(self):
+        self.assertEqual(nand.hamming_ecc('\xff' * nand.ECC_BLOCK), '\xff\xff\xff')
+        for block in self.blocks:
+            self.assertEqual(nand.hamming_ecc(block), reference_ecc(block))
+        page = ''.join(self.blocks[:8])
+        self.assertEqual(nand.hamming_ecc(page), ''.join(reference_ecc(block) for block in self.blocks[:8]))
+
+    def test_single_bit(self):
+        for block in self.blocks:
+            stored = nand.hamming_ecc(block)
+            self.assertEqual(nand.hamming_correct(block, stored, stored), None)
+            for byte in (0, 1, 0x7F, 0x80, 0xFF, self.random.randrange(nand.ECC_BLOCK)):
+                for bit in xrange(8):
+                    bad = self.flip(block, byte, bit)
+                    self.assertEqual(nand.hamming_correct(bad, stored, nand.hamming_ecc(bad)), (byte, bit))
+
+    def test_ecc_bit(self):
+        block = self.blocks[0]
+        computed = nand.hamming_ecc(block)
+        for byte in xrange(3):
+            for bit in xrange(2 if byte == 2 else 0, 8):
+                self.assertEqual(nand.hamming_correct(block, self.flip(computed, byte, bit), computed), 'ecc')
+
+    def test_two_bits(self):
+        block = self.blocks[1]
+        stored = nand.hamming_ecc(block)
+        bad = self.flip(self.flip(block, 3, 0), 9, 5)
+        self.assertEqual(nand.hamming_correct(bad, stored, nand.hamming_ecc(bad)), 'uncorrectable')
+
+class ProbeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def probe(self, dump):
+        path = os.path.join(self.dir, 'dump.bin')
+        with open(path, 'wb') as fp:
+            fp.write(dump)
+        with Image(path) as image:
+            return nand.probe(image)
+
+    def test_padded_pages(self):
+        # A quarter of each 2K page used, the rest and the spare area erased, no tags.
+        r = random.Random(6)
+        dump = ''.join(''.join(chr(r.randrange(256)) for i in xrange(0x200)) + '\xff' * (0x600 + 0x40)
+            for n in xrange(256))
+        geometry = self.probe(dump)
+        self.assertEqual((geometry.data_size, geometry.spare_size), (0x800, 0x40))
+
+    def test_no_evidence(self):
+        r = random.Random(7)
+        geometry = self.probe(''.join(chr(r.randrange(256)) for i in xrange(0x84000)))
+        self.assertEqual((geometry.data_size, geometry.spare_size, geometry.score), (0x800, 0x40, 0.0))
+
+class DepageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def flip(self, data, byte, bit=4):
+        return data[:byte] + chr(ord(data[byte]) ^ 1 << bit) + data[byte + 1:]
+
+    def build(self, pages, with_ecc=True):
+        "2K+64 spare areas for pages, holding their ECC unless erased"
+        positions = nand.ecc_positions(0x800, 0x40)
+        dump = []
+        for data in pages:
+            spare = bytearray('\xff' * 0x40)
+            if with_ecc:
+                for position, c in zip(positions, nand.hamming_ecc(data)):
+                    spare[position] = c
+            dump.append(str(spare))
+        return dump
+
+    def depage(self, dump):
+        image_path = os.path.join(self.dir, 'dump.bin')
+        with open(image_path, 'wb') as fp:
+            fp.write(''.join(dump))
+        out_path = os.path.join(self.dir, 'out.bin')
+        with Image(image_path) as image, open(out_path, 'wb') as out_fp:
+            report = nand.depage(image, out_fp, nand.Geometry(0x800, 0x40), ecc=True, correct=True)
+        with open(out_path, 'rb') as fp:
+            return report, fp.read()
+
+    def pages(self, seed):
+        r = random.Random(seed)
+        return [''.join(chr(r.randrange(256)) for i in xrange(0x800)) for n in xrange(4)]
+
+    def test_correct(self):
+        pages = self.pages(5)
+        spares = self.build(pages)
+        read = list(pages)
+        read[2] = self.flip(read[2], 0x123)
+        report, output = self.depage([data + spare for data, spare in zip(read, spares)])
+        self.assertEqual(report['pages'], 4)
+        self.assertEqual(report['corrected'], [2])
+        self.assertEqual(report['uncorrectable'], [])
+        self.assertEqual(output, ''.join(pages))
+
+    def test_erased_ecc(self):
+        # Written without ECC: the erased ECC bytes are not checked against the data.
+        pages = self.pages(8)
+        report, output = self.depage([data + spare for data, spare in zip(pages, self.build(pages, False))])
+        self.assertEqual((report['corrected'], report['ecc'], report['uncorrectable']), ([], [], []))
+        self.assertEqual(output, ''.join(pages))
+
+    def test_uncorrectable_page(self):
+        pages = self.pages(9)
+        spares = self.build(pages)
+        read = list(pages)
+        # One correctable block and one with two bad bits in the same page.
+        read[1] = self.flip(self.flip(self.flip(read[1], 0x10), 0x310, 1), 0x345, 6)
+        report, output = self.depage([data + spare for data, spare in zip(read, spares)])
+        self.assertEqual(report['corrected'], [1])
+        self.assertEqual(report['uncorrectable'], [1])
+        self.assertEqual(output, ''.join(read))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import distutils.spawn
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'zyxel'))
+import vmg3925crypt
+
+HAVE_AES = vmg3925crypt.AES is not None or distutils.spawn.find_executable(vmg3925crypt.OPENSSL) is not None
+
+class KeyTest(unittest.TestCase):
+
+    def test_derive_key(self):
+        # As printed by EVP_BytesToKey(EVP_aes_256_cbc(), EVP_sha1(), salt, key, 5 rounds).
+        key, iv = vmg3925crypt.derive_key(vmg3925crypt.KEY)
+        self.assertEqual(key.encode('hex'), '2409f885638031108e3df5910185ff1478a0c096a30aa40b83298598b754117c')
+        self.assertEqual(iv.encode('hex'), '3343d49e41e5ffb35bc0e582ef3fb84a')
+        self.assertIs(vmg3925crypt.derive_key(vmg3925crypt.KEY), vmg3925crypt.derive_key(vmg3925crypt.KEY))
+
+    def test_padding(self):
+        for length in (0, 1, 15, 16, 17):
+            padded = vmg3925crypt.pad('x' * length)
+            self.assertEqual(len(padded) % 16, 0)
+            self.assertEqual(vmg3925crypt.unpad(padded), 'x' * length)
+        self.assertRaises(ValueError, vmg3925crypt.unpad, 'x' * 15 + '\x11')
+
+@unittest.skipUnless(HAVE_AES, 'needs PyCrypto or the openssl binary')
+class CipherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cipher = vmg3925crypt.Cipher()
+        self.plains = ['admin1234', '', 'x' * 16, 'a longer one, "quoted", with \\ and \xe9, over 3 blocks']
+
+    def test_known_value(self):
+        # printf admin1234 | openssl enc -aes-256-cbc -K <key> -iv <iv> -a
+        self.assertEqual(self.cipher.encrypt('admin1234'), 'D0+KBMiFAhznpgI8qVEWgA==')
+        self.assertEqual(self.cipher.decrypt('D0+KBMiFAhznpgI8qVEWgA=='), 'admin1234')
+
+    def test_round_trip(self):
+        values = self.cipher.encrypt_many(self.plains)
+        self.assertEqual(values, [self.cipher.encrypt(plain) for plain in self.plains])
+        self.assertEqual(self.cipher.decrypt_many(values), self.plains)
+        self.assertEqual(self.cipher.decrypt_many([]), [])
+
+    def test_wrong_key(self):
+        value = vmg3925crypt.Cipher('other').encrypt('admin1234' * 3)
+        self.assertRaises(ValueError, self.cipher.decrypt, value)
+        self.assertRaises(ValueError, self.cipher.decrypt, 'QUJD')
+
+    def test_configs(self):
+        values = self.cipher.encrypt_many(self.plains)
+        configs = [json.dumps({'Password': '_encrypt_' + values[0], 'Other': ['_encrypt_' + v for v in values[1:]], 'n': 1}),
+            '{"Plain": "text"}']
+        decrypted, count = vmg3925crypt.decrypt_configs(configs, self.cipher)
+        self.assertEqual(count, 4)
+        self.assertEqual(decrypted[1], configs[1])
+        config = json.loads(decrypted[0])
+        self.assertEqual(config['Password'], '_decrypted_admin1234')
+        self.assertEqual(config['Other'][2], u'_decrypted_' + self.plains[3].decode('latin-1'))
+        encrypted, count = vmg3925crypt.encrypt_configs(decrypted, self.cipher)
+        self.assertEqual(count, 4)
+        self.assertEqual(encrypted, configs)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import zynos
+
+# Stand-ins for the lzma binary: one failing, one exiting fine with
+# output that is not the input.
+FAILING = '#!/bin/sh\ncat >/dev/null\necho "lzma: broken" >&2\nexit 1\n'
+LYING = '#!/bin/sh\ncat >/dev/null\nprintf "]\\000\\000\\200\\000garbage"\n'
+
+class ChecksumTest(unittest.TestCase):
+
+    def test_add_checksums(self):
+        r = random.Random(8)
+        data = ''.join(chr(r.randrange(256)) for i in xrange(1000))
+        sums = [zynos.checksum(data[i:i + 100]) for i in xrange(0, 1000, 100)]
+        self.assertEqual(zynos.add_checksums(sums), zynos.checksum(data))
+        self.assertEqual(zynos.add_checksums(iter(sums)), zynos.checksum(data))
+        self.assertEqual(zynos.add_checksums(iter([1, 2])), 3)
+        self.assertEqual(zynos.add_checksums(iter([0, 0])), 0)
+        self.assertEqual(zynos.add_checksums([]), 0)
+
+class TrialRomioTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.input_path = os.path.join(self.dir, 'ras.bin')
+        with open(self.input_path, 'wb') as fp:
+            fp.write('ZyNOS ' * 1000)
+        self.path = os.environ['PATH']
+        self.lzma = zynos.lzma
+        # The binary is only run without the module.
+        zynos.lzma = None
+    def tearDown(self):
+        zynos.lzma = self.lzma
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.dir)
+
+    def use_lzma(self, script):
+        bin_dir = os.path.join(self.dir, 'bin')
+        os.mkdir(bin_dir)
+        with open(os.path.join(bin_dir, 'lzma'), 'w') as fp:
+            fp.write(script)
+        os.chmod(os.path.join(bin_dir, 'lzma'), 0755)
+        os.environ['PATH'] = bin_dir + os.pathsep + self.path
+
+    def trial(self, compression):
+        output_path = os.path.join(self.dir, 'out.rom')
+        return zynos.trial_romio((self.input_path, output_path, compression, 4, 'V1'))
+
+    def test_working(self):
+        for compression in (None, 'bzip2'):
+            size, compress_time, decompress_time, failure = self.trial(compression)
+            self.assertEqual(failure, None)
+            self.assertEqual(size, os.path.getsize(os.path.join(self.dir, 'out.rom')))
+
+    def test_failing_compressor(self):
+        self.use_lzma(FAILING)
+        size, compress_time, decompress_time, failure = self.trial('lzma')
+        self.assertEqual(size, None)
+        self.assertIn('lzma: broken', failure)
+        self.assertFalse(os.path.exists(os.path.join(self.dir, 'out.rom')))
+
+    def test_wrong_output(self):
+        self.use_lzma(LYING)
+        for compression in ('lzma', 'lzma0'):
+            size, compress_time, decompress_time, failure = self.trial(compression)
+            self.assertEqual(size, None)
+            self.assertTrue(failure)
+
+    def test_compressor_error(self):
+        # Any error of one candidate is reported, not raised.
+        compress = zynos.compress_bz2_stream
+        def failing(chunks):
+            raise MemoryError()
+            yield ''
+        zynos.compress_bz2_stream = failing
+        try:
+            size, compress_time, decompress_time, failure = self.trial('bzip2')
+        finally:
+            zynos.compress_bz2_stream = compress
+        self.assertEqual(size, None)
+        self.assertEqual(failure, 'MemoryError')
+
+if __name__ == '__main__':
+    unittest.main()
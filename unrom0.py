@@ -2,49 +2,142 @@
 An overly simplistic tool to decompress rom-0 files.
 It probably does not work correctly.
 Still, it produces some useful output.
+
+The file holds directory blocks, the first one at 8192; each entry
+points at its data relative to the block. Compressed entries start
+with a magic number and are a series of LZS blocks.
 """
 
-import sys
-import struct
+import argparse
+import os
 import lzs
+from flashimage import Image
+
+BLOCK_OFFSET = 8192
+# Where else directory blocks are looked for.
+BLOCK_ALIGN = 0x2000
+BLOCK_MAX_ENTRIES = 64
+
+COMPRESSED_MAGIC = 0xCEEDDBDBL
+
+class Rom0Entry(object):
+    "A directory entry; offset is from the start of the file"
+
+    def __init__(self, name, length, unknown, offset, compressed):
+        self.name = name
+        self.length = length
+        self.unknown = unknown
+        self.offset = offset
+        self.compressed = compressed
+    def __str__(self):
+        return "Entry: %-14s Length: %04X %04X Offset: %04X%s" % (self.name, self.length, self.unknown, self.offset,
+            ' (compressed)' if self.compressed else '')
+
+class Rom0(object):
+    """
+    A rom-0 file: the directory is read into an index once, entries
+    are decompressed when first asked for
+    """
+
+    def __init__(self, path, block_offsets=None):
+        self.image = Image(path)
+        if block_offsets is None:
+            block_offsets = self.find_blocks()
+        self.blocks = []
+        self.entries = []
+        self.index = {}
+        for block_offset in block_offsets:
+            self.read_block(block_offset)
+        self._data = {}
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc_info):
+        self.close()
+    def close(self):
+        self.image.close()
+    def __iter__(self):
+        return iter(self.entries)
+    def __contains__(self, name):
+        return name in self.index
+    def __getitem__(self, name):
+        "Contents of an entry, decompressed if need be"
+        if name not in self._data:
+            entry = self.index[name]
+            if entry.compressed:
+                self._data[name] = self.decompress(entry.offset)
+            else:
+                self._data[name] = self.image.read(entry.offset, entry.length)
+        return self._data[name]
+    def find_blocks(self):
+        "Offsets of what look like directory blocks"
+        offsets = []
+        for offset in xrange(BLOCK_OFFSET, len(self.image) - 6, BLOCK_ALIGN):
+            if self.entries_at(offset) is not None:
+                offsets.append(offset)
+        return offsets
+    def entries_at(self, block_offset):
+        "Entries of the directory block at block_offset, None if it does not look like one"
+        block_id, block_entries, block_unk = self.image.unpack('>BxHH', block_offset)
+        if not 0 < block_entries <= BLOCK_MAX_ENTRIES or block_offset + 6 + block_entries * 20 > len(self.image):
+            return None
+        entries = []
+        for i in xrange(block_entries):
+            name, length, unknown, offset = self.image.unpack('>14sHHH', block_offset + 6 + i * 20)
+            name = name.rstrip('\0')
+            if not name or '\0' in name or not all(' ' < c < '\x7f' for c in name):
+                return None
+            offset += block_offset
+            if offset >= len(self.image):
+                return None
+            compressed = offset + 4 <= len(self.image) and self.image.unpack('>I', offset)[0] == COMPRESSED_MAGIC
+            entries.append(Rom0Entry(name, length, unknown, offset, compressed))
+        return (block_id, block_unk), entries
+    def read_block(self, block_offset):
+        (block_id, block_unk), entries = self.entries_at(block_offset)
+        self.blocks.append((block_offset, block_id, len(entries), block_unk))
+        for entry in entries:
+            self.entries.append(entry)
+            self.index.setdefault(entry.name, entry)
+    def decompress(self, offset):
+        "Decompress the series of LZS blocks following the header at offset"
+        offset += 12
+        window = lzs.Window()
+        output = []
+        while offset + 4 <= len(self.image):
+            tag, length = self.image.unpack('>HH', offset)
+            if tag != lzs.BLOCK_TAG:
+                break
+            output.append(lzs.decompress(self.image.view(offset + 4, length), window))
+            offset += 4 + length
+        return ''.join(output)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('rom0_path')
+    parser.add_argument('names',
+        nargs='*',
+        help='entries to extract (default: all of them)')
+    parser.add_argument('--output-dir',
+        dest='output_dir',
+        default='.',
+        help='where to write the entries (default: current directory)')
+    parser.add_argument('--list',
+        action='store_true',
+        help='only list the entries')
+    args = parser.parse_args()
 
-def process_spt(fp):
-    magic, h1, h2, h3 = struct.unpack('>IHHI', fp.read(12))
-    if magic != 0xCEEDDBDBL:
-        print "Magic number doesn't match."
-        return
-    ofp = open('spt.dat', 'wb')
-    w = lzs.RingList(2048)
-    while True:
-        header2 = struct.unpack('>HH', fp.read(4))
-        if header2[0] != 0x0800:
-            break
-        print "Compressed block: %04X, length %04X" % header2
-        data = fp.read(header2[1])
-        dd = lzs.decompress(data, w)
-        #print hexdump(dd)
-        ofp.write(dd)
-        #break
-    ofp.close()
-
-def process_block(fp):
-    block_offset = fp.tell()
-    block_id, block_entries, block_unk = struct.unpack('>BxHH', fp.read(6))
-    print "Block %d, entries: %d, unk: %04X" % (block_id, block_entries, block_unk)
-    while block_entries > 0:
-        e = struct.unpack('>14sHHH', fp.read(20))
-        print "Entry: %s Length: %04X %04X Offset: %04X" % e
-        name, length, unknown, offset = e
-        name = name.strip('\0')
-        
-        next_offset = fp.tell()
-        fp.seek(block_offset + offset, 0)
-        if name == 'spt.dat':
-            process_spt(fp)
-        fp.seek(next_offset, 0)
-        
-        block_entries -= 1
-
-fp = open(sys.argv[1], 'rb')
-fp.seek(8192, 0)
-process_block(fp)
+    with Rom0(args.rom0_path) as rom0:
+        for block_offset, block_id, block_entries, block_unk in rom0.blocks:
+            print "Block %d at %04X, entries: %d, unk: %04X" % (block_id, block_offset, block_entries, block_unk)
+        for entry in rom0:
+            print entry
+        if not args.list:
+            for name in args.names or [entry.name for entry in rom0]:
+                if name not in rom0:
+                    print "No entry '%s'." % name
+                    continue
+                out_path = os.path.join(args.output_dir, os.path.basename(name))
+                data = rom0[name]
+                print "Writing %d bytes to '%s'" % (len(data), out_path)
+                with open(out_path, 'wb') as ofp:
+                    ofp.write(data)
@@ -8,24 +8,125 @@ http://www.ixo.de/info/zyxel_uclinux/
 """
 
 import argparse
+import ast
+import binascii
+import cStringIO
+import hashlib
+import itertools
+import json
+import multiprocessing
 import os.path
+import re
+import shutil
 import sys
 import struct
+import tempfile
 import bz2
 
 import subprocess
+import threading
+import time
+
+from flashimage import Image, view
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        # Fall back to running the lzma binary.
+        lzma = None
+
+# Objects are streamed through in pieces of this size.
+STREAM_CHUNK = 0x10000
+
+# Dictionary size (log2) of the stock images. Unpack recognizes LZMA
+# data by "]\0\0", which holds for dictionaries of 64 KB and up.
+LZMA_DICT_BITS = 23
+LZMA_DICT_RANGE = range(16, 28)
+
+def lzma_filters(dict_bits=LZMA_DICT_BITS):
+    "What 'lzma -e -d<bits>' uses: lc=3 lp=0 pb=2, the LZMA SDK defaults otherwise"
+    return [{
+        'id': lzma.FILTER_LZMA1,
+        'dict_size': 1 << dict_bits,
+        'lc': 3, 'lp': 0, 'pb': 2,
+        'mode': lzma.MODE_NORMAL,
+        'mf': lzma.MF_BT4,
+        'nice_len': 32,
+    }]
+
+def _lzma_failed(p, error):
+    return RuntimeError("lzma exited with %d: %s" % (p.returncode, error.strip() or 'no message'))
+def _run_lzma(args, data):
+    p = subprocess.Popen(['lzma'] + args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=False)
+    output, error = p.communicate(data)
+    if p.returncode != 0:
+        raise _lzma_failed(p, error)
+    return output
 def decompress_lzma(data):
-    p = subprocess.Popen(['lzma', '-d'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=False)
-    r = p.communicate(data)
-    return r[0]
-def compress_lzma(data):
-    p = subprocess.Popen(['lzma', '-e', '-d23'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=False)
-    r = p.communicate(data)
-    return r[0]
+    "Decompress an LZMA-alone stream from a string or a buffer/memoryview"
+    if lzma is not None:
+        return lzma.LZMADecompressor(format=lzma.FORMAT_ALONE).decompress(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return _run_lzma(['-d'], str(data))
+def compress_lzma(data, dict_bits=LZMA_DICT_BITS):
+    if lzma is not None:
+        return lzma.compress(data, format=lzma.FORMAT_ALONE, filters=lzma_filters(dict_bits))
+    return _run_lzma(['-e', '-d%d' % dict_bits], data)
+def compress_lzma_stream(chunks, dict_bits=LZMA_DICT_BITS):
+    "Compress an iterable of strings, yielding the output as it comes"
+    if lzma is not None:
+        c = lzma.LZMACompressor(format=lzma.FORMAT_ALONE, filters=lzma_filters(dict_bits))
+        for chunk in chunks:
+            data = c.compress(chunk)
+            if data:
+                yield data
+        yield c.flush()
+        return
+    p = subprocess.Popen(['lzma', '-e', '-d%d' % dict_bits], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=False)
+    def feed():
+        try:
+            for chunk in chunks:
+                p.stdin.write(chunk)
+        except IOError:
+            # lzma quit early; its exit status tells why.
+            pass
+        finally:
+            p.stdin.close()
+    feeder = threading.Thread(target=feed)
+    feeder.start()
+    for data in iter(lambda: p.stdout.read(STREAM_CHUNK), ''):
+        yield data
+    feeder.join()
+    error = p.stderr.read()
+    if p.wait() != 0:
+        raise _lzma_failed(p, error)
+def splice_lzma_size(chunks, size):
+    "Put the original size into the LZMA header, lzma leaves it unknown"
+    head = ''
+    for chunk in chunks:
+        if head is not None:
+            head += chunk
+            if len(head) < 13:
+                continue
+            chunk = head[:5] + struct.pack('<Q', size) + head[13:]
+            head = None
+        yield chunk
+    if head:
+        yield head
 def decompress_bz2(data):
     return bz2.decompress(data)
 def compress_bz2(data):
     return bz2.compress(data)
+def compress_bz2_stream(chunks):
+    c = bz2.BZ2Compressor()
+    for chunk in chunks:
+        data = c.compress(chunk)
+        if data:
+            yield data
+    yield c.flush()
 #
 
 class RomIoHeader(struct.Struct):
@@ -118,6 +219,10 @@ class MemoryMapEntry(struct.Struct):
             self.name = ''
             self.address = 0L
             self.length = 0L
+        # Where unpack found the object, not part of the table itself.
+        self.offset = None
+        self.checksum = None
+        self.compression = None
     def __str__(self):
         try:
             type_name = MemoryMapEntry.Type1Names[self.type1]
@@ -129,40 +234,156 @@ class MemoryMapEntry(struct.Struct):
     def unpack(self, source):
         self.type1, self.name, self.address, self.length, self.type2 = struct.Struct.unpack(self, source)
 #
+# The checksum is a 16-bit sum of big-endian words with end-around carry,
+# i.e. a sum modulo 0xFFFF. As 0x10000 == 1 (mod 0xFFFF), a run of words
+# read as one big-endian integer leaves the same residue as their sum,
+# so the data is summed in large chunks and the carries folded once.
+CHECKSUM_CHUNK = 0x100000
+
+class ZynosChecksum(object):
+    """Running ZyNOS checksum of data fed in pieces of any length"""
+
+    def __init__(self, data=None):
+        self.length = 0
+        self._sum = 0
+        self._nonzero = False
+        # High byte of a word split across two update() calls.
+        self._high = None
+        if data is not None:
+            self.update(data)
+    def update(self, data):
+        length = len(data)
+        if not length:
+            return
+        offset = 0
+        if self._high is not None:
+            self._add((self._high << 8) | struct.unpack_from('B', data, 0)[0])
+            self._high = None
+            offset = 1
+        end = offset + ((length - offset) & ~1)
+        while offset < end:
+            size = min(CHECKSUM_CHUNK, end - offset)
+            self._add(int(binascii.hexlify(view(data, offset, size)), 16))
+            offset += size
+        if offset < length:
+            self._high = struct.unpack_from('B', data, offset)[0]
+        self.length += length
+    def _add(self, value):
+        if value:
+            self._nonzero = True
+            self._sum = (self._sum + value) % 0xFFFF
+    def digest(self):
+        sum = self._sum
+        nonzero = self._nonzero
+        if self._high:
+            # Odd trailing byte goes into the high half of a word.
+            sum += self._high << 8
+            nonzero = True
+        # A running sum never wraps back to zero once it is non-zero.
+        if not nonzero:
+            return 0
+        return sum % 0xFFFF or 0xFFFF
+#
 def checksum(data):
+    return ZynosChecksum(data).digest()
+#
+def add_checksums(sums):
+    """
+    Combine checksums of pieces of data into the checksum of the whole;
+    pieces must be word-aligned (or checksummed with a zero byte in front)
+    """
     sum = 0
-    offset = 0
-    limit = (len(data) >> 1) << 1
-    while offset < limit:
-        sum += (ord(data[offset]) << 8) + ord(data[offset + 1])
-        if sum > 0xFFFF:
-            sum = (1 + sum) & 0xFFFF
-        offset += 2
-    if offset != len(data):
-        sum += ord(data[-1]) << 8
-        if sum > 0xFFFF:
-            sum = (1 + sum) & 0xFFFF
-    return sum
+    nonzero = False
+    for value in sums:
+        sum += value
+        nonzero = nonzero or value != 0
+    if not nonzero:
+        return 0
+    return sum % 0xFFFF or 0xFFFF
 #
-def do_unpack(args):
-    "Process the input image"
+def find_memory_map(image, mmap_addr=None):
+    """
+    Locate the memory map table in an image (string, mmap, ...);
+    return every plausible (offset, MemoryMapHeader, confidence,
+    checksum_ok) candidate, those with a matching table checksum
+    first, then the most confident first.
+
+    The table lives at a 0x100-aligned offset, and its header must
+    point the USER area right past the table placed at mmap_addr
+    (taken from the ROMIO header by default). Candidates passing that
+    check score 0.5 for a matching table checksum and 0.25 each for
+    known entry types and a ROMMAP entry at mmap_addr.
+    """
+    if mmap_addr is None:
+        mmap_addr = RomIoHeader(view(image, 0, 0x30)).mmap_addr
+    size = len(image)
+    count = max(0, (size - 0x200 + 0xFF) // 0x100)
+    # Header counts and USER start addresses of all aligned candidates
+    # in one go; only those passing the address check get a closer look.
+    fields = struct.unpack_from('>' + 'HI250x' * count, image, 0x100) if count else ()
+    offsets = [0x100 + (i << 8)
+        for i, (entries, user_start) in enumerate(zip(fields[0::2], fields[1::2]))
+        if user_start - (entries + 1) * 0x18 == mmap_addr]
 
+    candidates = []
+    for offset in offsets:
+        mmh = MemoryMapHeader(view(image, offset, 0x18))
+        mmt_length = mmh.user_end - mmap_addr - 0x18
+        if not 0 <= mmt_length < size - offset - 0x18:
+            continue
+        if offset + (mmh.count + 1) * 0x18 > size:
+            continue
+        confidence = 0.0
+        checksum_ok = checksum(view(image, offset + 0x18, mmt_length)) == mmh.checksum
+        if checksum_ok:
+            confidence += 0.5
+        entries = [MemoryMapEntry(view(image, offset + 0x18 * (1 + i), 0x18)) for i in xrange(mmh.count)]
+        if all(e.type1 in MemoryMapEntry.Type1Names for e in entries):
+            confidence += 0.25
+        if any(e.type1 == 7 and e.address == mmap_addr for e in entries):
+            confidence += 0.25
+        candidates.append((offset, mmh, confidence, checksum_ok))
+    candidates.sort(key=lambda c: (not c[3], -c[2]))
+    return candidates
+#
+def do_unpack(args):
+    """
+    Process the input image; return a summary dict of what was
+    found, with 'error' set when the image could not be unpacked
+    """
     print("Processing the RAS image from '%s'." % args.input_file)
-    fp = open(args.input_file, 'rb')
-    fp.seek(0, 2)
-    image_size = fp.tell()
-    fp.seek(0, 0)
+    with Image(args.input_file) as image:
+        return unpack_image(args, image)
 
-    romio_header = RomIoHeader(fp.read(0x30))
+def unpack_image(args, image):
+    summary = {'error': None}
+    def fail(message):
+        print(message)
+        summary['error'] = message
+        return summary
+
+    image_size = len(image)
+
+    romio_header = RomIoHeader(image.read(0, 0x30))
     print("ZyNOS ROMIO header:")
     print(str(romio_header))
+    summary['romio'] = {
+        'type': romio_header.type,
+        'load_addr': romio_header.load_addr,
+        'mmap_addr': romio_header.mmap_addr,
+        'flags': romio_header.flags,
+        'orig_length': romio_header.orig_length,
+        'orig_checksum': romio_header.orig_checksum,
+        'comp_length': romio_header.comp_length,
+        'comp_checksum': romio_header.comp_checksum,
+        'version': romio_header.version.strip("\0"),
+    }
 
     if romio_header.flags & 0x40:
         print("Verifying image checksum...")
-        this_checksum = checksum(fp.read(romio_header.orig_length))
+        this_checksum = checksum(image.view(0x30, romio_header.orig_length))
         if this_checksum != romio_header.orig_checksum:
-            print("Checksum verification failed: expected %04X, calculated %04X" % (romio_header.orig_checksum, this_checksum))
-            return
+            return fail("Checksum verification failed: expected %04X, calculated %04X" % (romio_header.orig_checksum, this_checksum))
     print('')
 
     if args.prefix is None:
@@ -174,53 +395,36 @@ def do_unpack(args):
     if not args.dry_run:
         if os.path.exists(out_prefix):
             if not os.path.isdir(out_prefix):
-                print("Output path already exists and is not a directory; can't write there.")
-                return
+                return fail("Output path already exists and is not a directory; can't write there.")
             else:
                 print("Output path already exists; writing there.")
         else:
             try:
                 os.mkdir(out_prefix)
             except OSError:
-                print("Failed to create output path.")
-                return
+                return fail("Failed to create output path.")
 
     print("Searching for memory map table...")
-    fp.seek(0, 2)
-    size = fp.tell()
-    mmh_offset = 0x100
-    mmh = MemoryMapHeader()
-    while mmh_offset < size - 0x100:
-        fp.seek(mmh_offset)
-        mmh.unpack(fp.read(0x18))
-        mmt_size = (mmh.count + 1) * 0x18
-        calculated_addr = mmh.user_start - mmt_size
-        if calculated_addr == romio_header.mmap_addr:
-            mmt_length = mmh.user_end - romio_header.mmap_addr - 0x18
-            if 0 <= mmt_length < size - mmh_offset:
-                if checksum(fp.read(mmt_length)) == mmh.checksum:
-                    print("Memory map table found at offset %08X in the image." % mmh_offset)
-                    break
-        mmh_offset += 0x100
-    else:
-        print("Memory map table not found!")
-        return
+    candidates = find_memory_map(image.data, romio_header.mmap_addr)
+    # Only a candidate with a matching table checksum will do.
+    if not candidates or not candidates[0][3]:
+        return fail("Memory map table not found!")
+    mmh_offset, mmh, confidence, checksum_ok = candidates[0]
+    print("Memory map table found at offset %08X in the image." % mmh_offset)
+    mmt_size = (mmh.count + 1) * 0x18
 
-    fp.seek(mmh_offset + 0x18)
     mmt = []
     while len(mmt) < mmh.count:
-        e = MemoryMapEntry(fp.read(0x18))
+        e = MemoryMapEntry(image.view(mmh_offset + 0x18 * (1 + len(mmt)), 0x18))
         e.name = e.name.rstrip("\0")
         mmt.append(e)
-    if not args.dry_run:
-        with open(out_prefix + '/.map', 'wt') as out:
-            out.write("[\n")
-            out.write("# Name, Address, Size, Type1, Type2\n")
-            for mme in mmt:
-                out.write("('%s', 0x%08XL, 0x%08XL, %d, %d),\n" % (mme.name, mme.address, mme.length, mme.type1, mme.type2))
-            out.write("]\n")
+    summary['memory_map'] = {
+        'offset': mmh_offset,
+        'confidence': confidence,
+        'entries': [(e.name, e.address, e.length, e.type1, e.type2) for e in mmt],
+    }
     if romio_header.mmap_addr + mmt_size == mmh.user_start:
-        user = fp.read(mmh.user_end - mmh.user_start + 1)
+        user = image.view(mmh_offset + mmt_size, mmh.user_end - mmh.user_start + 1)
         if not args.dry_run:
             out_name = out_prefix + '/.user'
             print("Writing %d bytes of $USER data to '%s'" % (len(user), out_name))
@@ -236,12 +440,18 @@ def do_unpack(args):
     for mme in mmt:
         if mme.type1 == 1 and mme.name == 'BootExt':
             image_base = mme.address - 0x30
+            image.base = image_base
             print("The image is based at %08X in the address space." % image_base)
             break
     else:
-        print("No BootExt section -- can't figure out where the image is based")
-        return
+        return fail("No BootExt section -- can't figure out where the image is based")
+
+    summary['image_base'] = image_base
 
+    # Plan all the objects first: what goes where and how it is packed.
+    summary['compression'] = compression = {}
+    jobs = []
+    writes = []
     for mme in mmt:
         print('')
         print("Object: " + str(mme))
@@ -250,8 +460,8 @@ def do_unpack(args):
             print("-> RAM object, nothing to write out.")
             continue
 
-        offset = mme.address - image_base
-        if offset < 0 or offset >= image_size:
+        offset = image.offset_of(mme.address)
+        if not image.contains(mme.address):
             print("-> No data in the image for this object, skipped.")
             continue
 
@@ -259,83 +469,316 @@ def do_unpack(args):
 
         if mme.type1 == 4:
             # ROMBIN: (compressed) image with ROMIO header
-            fp.seek(offset)
-            sh = RomIoHeader(fp.read(0x30))
+            sh = RomIoHeader(image.read(offset, 0x30))
             print("-> ZyNOS ROMIO header found, version string: %s." % sh.version.strip("\0"))
             if sh.flags & 0x80:
                 print("-> Data is compressed, compressed/original length: %08X/%08X." % (sh.comp_length, sh.orig_length))
-                df = None
-                tag = fp.read(3)
+                method = None
+                data_offset = offset + 0x30
+                tag = image.read(data_offset, 3)
                 if tag == "\0\0\0":
                     # Some firmware requires 3 zero bytes before actual LZMA data...
-                    tag = fp.read(3)
+                    tag = image.read(data_offset + 3, 3)
                     if tag == "]\0\0":
                         print("-> Compression method: LZMA (3 zeros prepended)")
-                        df = decompress_lzma
-                        fp.seek(-3, 1)
+                        method = 'lzma0'
+                        data_offset += 3
                     else:
                         print("-> Compression method: UNKNOWN")
-                        fp.seek(-6, 1)
                 elif tag == "]\0\0":
                     print("-> Compression method: LZMA")
-                    df = decompress_lzma
-                    fp.seek(-3, 1)
+                    method = 'lzma'
                 elif tag == "BZh":
                     print("-> Compression method: bzip2")
-                    df = decompress_bz2
-                    fp.seek(-3, 1)
+                    method = 'bzip2'
                 else:
                     print("-> Compression method: UNKNOWN")
-                    fp.seek(-3, 1)
-                data = fp.read(sh.comp_length)
-                
-                if df:
-                    data = df(data)
-
-                if not args.dry_run:
-                    out_fp = open(out_name, 'wb')
-                    out_fp.write(data)
-                    out_fp.close()
-                
-                data_length = sh.comp_length + 0x30
+                compression[mme.name] = mme.compression = method or 'unknown'
+                jobs.append((args.input_file, data_offset, sh.comp_length, method))
+                writes.append((out_name, None, None))
             else:
                 print("-> Data is not compressed, length: %08X." % sh.orig_length)
-                data_length = sh.orig_length + 0x30
+                compression[mme.name] = mme.compression = 'none'
             out_name += '.rom'
         else:
             # Everything else:
             print("-> Raw data.")
 
         data_length = mme.length
-        fp.seek(offset)
-        data = fp.read(data_length)
-        if len(data) != data_length:
+        if offset + data_length > image_size:
             print("-> NOTE: not all data is in the image.")
-        if not args.dry_run:
-            print("-> Writing %d bytes to '%s'." % (data_length, out_name))
-            out_fp = open(out_name, 'wb')
-            out_fp.write(data)
-            out_fp.close()
-        else:
-            print("-> Would write %d bytes to '%s'." % (data_length, out_name))
-    return
+        mme.offset = offset
+        mme.checksum = checksum(image.view(offset, data_length))
+        writes.append((out_name, offset, data_length))
+
+    # Decompression is CPU-bound and the objects are independent, so it
+    # goes to worker processes; the results come back in plan order.
+    print('')
+    if args.jobs > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(args.jobs, len(jobs)))
+        results = pool.imap(extract_object, jobs)
+    else:
+        pool = None
+        results = itertools.imap(extract_object, jobs)
+    try:
+        for out_name, offset, data_length in writes:
+            if offset is None:
+                data = next(results)
+            else:
+                data = image.view(offset, data_length)
+            if not args.dry_run:
+                print("-> Writing %d bytes to '%s'." % (len(data), out_name))
+                with open(out_name, 'wb') as out_fp:
+                    out_fp.write(data)
+            else:
+                print("-> Would write %d bytes to '%s'." % (len(data), out_name))
+    finally:
+        if pool is not None:
+            pool.terminate()
+    if not args.dry_run:
+        write_map(out_prefix + '/.map', mmt)
+    return summary
 #
-def read_map(map_path):
+DECOMPRESSORS = {
+    'lzma': decompress_lzma,
+    'lzma0': decompress_lzma,
+    'bzip2': decompress_bz2,
+}
+
+def extract_object(job):
+    "Decompress one object; job is (image path, offset, length, method)"
+    path, offset, length, method = job
+    with Image(path) as image:
+        data = image.view(offset, length)
+        if method is None:
+            return str(data)
+        return DECOMPRESSORS[method](data)
+#
+def hash_file(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        for data in iter(lambda: fp.read(STREAM_CHUNK), ''):
+            h.update(data)
+    return h.hexdigest()
+#
+def unpack_quietly(task):
+    "Batch worker: unpack one image, its output goes to .log in the prefix"
+    path, prefix, dry_run = task
+    if not dry_run:
+        try:
+            os.makedirs(os.path.dirname(prefix))
+        except OSError:
+            pass
+    log = cStringIO.StringIO()
+    stdout = sys.stdout
+    sys.stdout = log
+    try:
+        summary = do_unpack(argparse.Namespace(input_file=path, prefix=prefix, dry_run=dry_run, jobs=1))
+    except Exception as e:
+        summary = {'error': '%s: %s' % (type(e).__name__, e)}
+    finally:
+        sys.stdout = stdout
+    if not dry_run and os.path.isdir(prefix):
+        with open(os.path.join(prefix, '.log'), 'w') as fp:
+            fp.write(log.getvalue())
+    return summary
+#
+def do_batch(args):
+    input_dir = args.input_dir.rstrip('/')
+    summary_path = args.summary or input_dir + '.jsonl'
+    output_dir = args.output_dir or input_dir + '.unpacked'
+
+    # The summary of the previous run doubles as the cache.
+    previous = {}
+    try:
+        with open(summary_path, 'r') as fp:
+            for line in fp:
+                record = json.loads(line)
+                previous[record['path']] = record
+        print("Loaded %d records from '%s'." % (len(previous), summary_path))
+    except IOError:
+        pass
+
+    records = []
+    tasks = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            rel_path = os.path.relpath(path, input_dir)
+            digest = hash_file(path)
+            record = previous.get(rel_path)
+            if record is not None and record.get('sha1') == digest:
+                records.append(record)
+                continue
+            record = {'path': rel_path, 'sha1': digest, 'size': os.path.getsize(path)}
+            records.append(record)
+            tasks.append((record, (path, os.path.join(output_dir, rel_path + '.unpacked'), args.dry_run)))
+    print("%d images found, %d unchanged, %d to unpack." % (len(records), len(records) - len(tasks), len(tasks)))
+
+    pool = multiprocessing.Pool(args.jobs)
+    try:
+        results = pool.imap(unpack_quietly, [task for record, task in tasks])
+        for (record, task), summary in itertools.izip(tasks, results):
+            record.update(summary)
+            print("%s: %s" % (record['path'], record['error'] or 'OK'))
+    finally:
+        pool.terminate()
+
+    if not args.dry_run:
+        with open(summary_path, 'w') as fp:
+            for record in records:
+                fp.write(json.dumps(record, sort_keys=True, encoding='latin-1') + "\n")
+        print("Summary written to '%s'." % summary_path)
+#
+def write_checksummed(out_fp, csum, data):
+    out_fp.write(data)
+    csum.update(data)
+#
+def copy_checksummed(fp, out_fp, csum):
+    "Copy a file in bounded chunks, checksumming what is written"
+    while True:
+        data = fp.read(STREAM_CHUNK)
+        if not data:
+            break
+        write_checksummed(out_fp, csum, data)
+#
+# Sidecar files start with a format line: a tag and the format version.
+MAP_FORMAT = ('zynos-map', '1')
+COMP_FORMAT = ('zynos-comp', '1')
+COMP_NAMES = ('none', 'lzma', 'lzma0', 'bzip2', 'unknown')
+
+def escape_name(name):
+    "Object names as single fields: whitespace, '#', '-' and '\\' escaped"
+    if not name:
+        return '\\x00'
+    return re.sub(r'[^\x21-\x7e]|[#\\]|^-$', lambda m: '\\x%02x' % ord(m.group()), name)
+def unescape_name(field):
+    return re.sub(r'\\x([0-9a-f]{2})', lambda m: chr(int(m.group(1), 16)), field).rstrip("\0")
+#
+def read_sidecar(path, fmt, width):
+    """
+    Yield (line number, fields) for every data line of a sidecar file;
+    raise ValueError unless the format line and field counts match
+    """
+    with open(path, 'r') as fp:
+        lines = fp.read().splitlines()
+    if not lines or tuple(lines[0].split()[:1]) != fmt[:1]:
+        raise ValueError("%s: not a %s file" % (path, fmt[0]))
+    if tuple(lines[0].split()) != fmt:
+        raise ValueError("%s: unsupported format '%s'" % (path, lines[0]))
+    for number, line in enumerate(lines[1:], 2):
+        if not line.strip() or line.startswith('#'):
+            continue
+        fields = line.split()
+        if len(fields) != width:
+            raise ValueError("%s:%d: %d fields expected, %d found" % (path, number, width, len(fields)))
+        yield number, fields
+def sidecar_int(path, number, field, base=16, optional=False):
+    if optional and field == '-':
+        return None
+    try:
+        return int(field, base)
+    except ValueError:
+        raise ValueError("%s:%d: bad number '%s'" % (path, number, field))
+#
+def read_legacy_map(map_path):
+    "Entries of a .map written as a Python literal by older versions"
     with open(map_path, 'r') as fp:
-        mmt_source = eval(fp.read())
+        entries = ast.literal_eval(fp.read())
     mmt = []
-    for x in mmt_source:
+    for x in entries:
         y = MemoryMapEntry()
         y.name, y.address, y.length, y.type1, y.type2 = x
         mmt.append(y)
     return mmt
+def read_map(map_path):
+    """
+    Read a memory map sidecar:
+
+        zynos-map 1
+        # Name   Address  Size     Type1 Type2 Offset   Checksum Compression
+        BootExt  80100000 00004000 82    00    -        -        -
+
+    Numbers are hex; the last three columns are what unpack found in
+    the image, '-' where it does not apply
+    """
+    try:
+        lines = list(read_sidecar(map_path, MAP_FORMAT, 8))
+    except ValueError:
+        with open(map_path, 'r') as fp:
+            if fp.read(1) != '[':
+                raise
+        print("NOTE: '%s' is in the old format, the convert command updates it." % map_path)
+        return read_legacy_map(map_path)
+    mmt = []
+    for number, fields in lines:
+        y = MemoryMapEntry()
+        y.name = unescape_name(fields[0])
+        y.address, y.length, y.type1, y.type2 = [sidecar_int(map_path, number, x) for x in fields[1:5]]
+        y.offset = sidecar_int(map_path, number, fields[5], optional=True)
+        y.checksum = sidecar_int(map_path, number, fields[6], optional=True)
+        if fields[7] != '-' and fields[7] not in COMP_NAMES:
+            raise ValueError("%s:%d: unknown compression '%s'" % (map_path, number, fields[7]))
+        y.compression = None if fields[7] == '-' else fields[7]
+        mmt.append(y)
+    return mmt
+def write_map(map_path, mmt):
+    def optional(value, fmt):
+        return '-' if value is None else fmt % value
+    with open(map_path, 'w') as out:
+        out.write("%s %s\n" % MAP_FORMAT)
+        out.write("# Name   Address  Size     Type1 Type2 Offset   Checksum Compression\n")
+        for mme in mmt:
+            out.write("%-8s %08X %08X %02X    %02X    %-8s %-8s %s\n" % (escape_name(mme.name),
+                mme.address, mme.length, mme.type1, mme.type2,
+                optional(mme.offset, '%08X'), optional(mme.checksum, '%04X'), optional(mme.compression, '%s')))
 #
 def read_comp(comp_path):
+    """
+    Read the compression sidecar telling pack which objects to build
+    from the plain object file, and how:
+
+        zynos-comp 1
+        RasCode lzma:20
+
+    Methods are as for romio --compression, 'none' for no compression
+    """
     try:
-        with open(comp_path, 'r') as fp:
-            return eval(fp.read())
+        lines = list(read_sidecar(comp_path, COMP_FORMAT, 2))
     except IOError:
         return {}
+    except ValueError:
+        with open(comp_path, 'r') as fp:
+            if fp.read(1) != '{':
+                raise
+        print("NOTE: '%s' is in the old format, the convert command updates it." % comp_path)
+        with open(comp_path, 'r') as fp:
+            return ast.literal_eval(fp.read())
+    comp = {}
+    for number, (name, method) in lines:
+        method = None if method == 'none' else method
+        try:
+            parse_compression(method)
+        except ValueError as e:
+            raise ValueError("%s:%d: %s" % (comp_path, number, e))
+        comp[unescape_name(name)] = method
+    return comp
+def write_comp(comp_path, comp):
+    with open(comp_path, 'w') as out:
+        out.write("%s %s\n" % COMP_FORMAT)
+        for name in sorted(comp):
+            out.write("%s %s\n" % (escape_name(name), comp[name] or 'none'))
+#
+def do_convert(args):
+    "Rewrite the sidecar files of an unpacked tree in the current format"
+    map_path = os.path.join(args.input_dir, '.map')
+    write_map(map_path, read_map(map_path))
+    print("Converted '%s'." % map_path)
+    comp_path = os.path.join(args.input_dir, '.comp')
+    if os.path.exists(comp_path):
+        write_comp(comp_path, read_comp(comp_path))
+        print("Converted '%s'." % comp_path)
 #
 def pad_data(data):
     tail = len(data) & 0x3FF
@@ -406,86 +849,359 @@ def do_pack(args):
     mmh.checksum = checksum(mmt_data)
     mmt_data = pad_data(mmh.pack() + mmt_data)
 
+    # Objects listed in .comp are built from the plain object file,
+    # compressed with the given method; their ROMIO blobs are cached.
     comp = read_comp(os.path.join(args.input_dir, '.comp'))
-    out_fp = open('ras', 'w+b')
-    out_fp.write("\0" * 0x30)
+    cache = PackCache(os.path.join(args.input_dir, '.cache'))
+
+    # Lay the image out first, so problems show up before anything is
+    # written and the output can then be streamed in a single pass.
+    layout = []
+    end = 0x30
+    for mme in rom_objects_with_data:
+        if mme.type1 == 1 or mme.type1 == 4:
+            # ROMIMG, ROMBIN
+            path = os.path.join(args.input_dir, mme.name)
+            if mme.type1 == 4:
+                if mme.name in comp and os.path.exists(path):
+                    try:
+                        path = cache.romio(path, comp[mme.name], *romio_settings(path + '.rom'))
+                    except RuntimeError as e:
+                        print("Could not compress '%s': %s" % (path, e))
+                        return
+                else:
+                    path += '.rom'
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                print("WARN: Could not open '%s', '%s' not written" % (path, mme.name))
+                continue
+            identity = cache.identity(path)
+        elif mme.type1 == 7:
+            # ROMMAP
+            path = None
+            size = len(mmt_data)
+            identity = hashlib.sha1(mmt_data).hexdigest()
+        else:
+            print("Don't know how to write object type %d!" % mme.type1)
+            continue
+        offset = mme.address - image_base
+        if offset < end:
+            print("WARN: '%s' overlaps the previous object, not written" % mme.name)
+            continue
+        layout.append((mme, offset, path, size, identity))
+        end = offset + size
+    print("Image layout:")
+    for mme, offset, path, size, identity in layout:
+        print("  %08X..%08X '%s'" % (offset, offset + size, mme.name))
+    print('')
+
+    # When the previous image has the same layout and was not touched
+    # since, only the objects that changed are written into a copy of it.
+    out_path = os.path.abspath(args.output)
+    previous = cache.previous_image(out_path, [(offset, size) for mme, offset, path, size, identity in layout])
+
+    # Written to a temporary file next to the output and renamed over
+    # it once complete, so a failure never leaves a truncated image.
+    fd, temp_path = tempfile.mkstemp(prefix='.ras-', dir=os.path.dirname(out_path))
     try:
-        for mme in rom_objects_with_data:
-            print("Writing '%s'..." % mme.name)
-            if mme.type1 == 1:
-                # ROMIMG
-                path = os.path.join(args.input_dir, mme.name)
-                try:
-                    print("Trying '%s'..." % path)
-                    fp = open(path, 'rb')
-                except IOError:
-                    print("WARN: Could not open the source object binary, not written")
-                    continue
-                out_fp.seek(mme.address - image_base, 0)
-                out_fp.write(fp.read())
-                fp.close()
-            elif mme.type1 == 4:
-                # ROMBIN
-                path = os.path.join(args.input_dir, mme.name + '.rom')
-                try:
-                    print("Trying '%s'..." % path)
-                    fp = open(path, 'rb')
-                except IOError:
-                    print("WARN: Could not open the source object binary, not written")
+        if previous:
+            os.close(fd)
+            shutil.copyfile(out_path, temp_path)
+            out_fp = open(temp_path, 'r+b')
+        else:
+            out_fp = os.fdopen(fd, 'wb')
+        with out_fp:
+            out_fp.write("\0" * 0x30)
+            # Objects are checksummed one by one as they are written,
+            # the header checksum is the sum of those.
+            records = []
+            for mme, offset, path, size, identity in layout:
+                record = previous.get(offset) if previous else None
+                if record is not None and record['identity'] == identity:
+                    print("Keeping '%s'." % mme.name)
+                    records.append(record)
                     continue
-                out_fp.seek(mme.address - image_base, 0)
-                out_fp.write(fp.read())
-                fp.close()
-            elif mme.type1 == 7:
-                # ROMMAP
-                out_fp.write(mmt_data)
-            else:
-                print("Don't know how to write object type %d!" % mme.type1)
+                print("Writing '%s'..." % mme.name)
+                csum = ZynosChecksum()
+                if (offset - 0x30) & 1:
+                    # Odd bytes go into the low halves of the words.
+                    csum.update("\0")
+                out_fp.seek(offset, 0)
+                if path is None:
+                    write_checksummed(out_fp, csum, mmt_data)
+                else:
+                    with open(path, 'rb') as fp:
+                        copy_checksummed(fp, out_fp, csum)
+                records.append({'name': mme.name, 'offset': offset, 'size': size, 'identity': identity, 'checksum': csum.digest()})
+            print("Updating ROMIO header...")
+            hdr = RomIoHeader()
+            hdr.type = 3
+            hdr.flags = 0x40
+            hdr.load_addr = be_ram_address
+            hdr.mmap_addr = mmt_address
+            hdr.orig_length = end - 0x30
+            hdr.orig_checksum = add_checksums([record['checksum'] for record in records])
+            out_fp.seek(0, 0)
+            out_fp.write(hdr.pack())
+            out_fp.truncate(end)
+        publish(temp_path, out_path)
     except:
-        out_fp.close()
-    print("Updating ROMIO header...")
-    hdr = RomIoHeader()
-    hdr.type = 3
-    hdr.flags = 0x40
-    hdr.load_addr = be_ram_address
-    hdr.mmap_addr = mmt_address
-    out_fp.seek(0x30, 0)
-    data = out_fp.read()
-    hdr.orig_length = len(data)
-    hdr.orig_checksum = checksum(data)
-    out_fp.seek(0, 0)
-    out_fp.write(hdr.pack())
-    out_fp.close()
+        os.remove(temp_path)
+        raise
+    cache.save_image(out_path, records)
+    print("Image written to '%s'." % args.output)
 #
-def do_romio(args):
-    with open(args.input_file, 'rb') as fp:
-        data = fp.read()
+def publish(temp_path, path):
+    "Give a finished temporary file the usual permissions and move it in place"
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(temp_path, 0666 & ~umask)
+    os.rename(temp_path, path)
+#
+def romio_settings(rom_path):
+    "Type and version string of an existing ROMIO file, or the defaults"
+    try:
+        with open(rom_path, 'rb') as fp:
+            hdr = RomIoHeader(fp.read(0x30))
+        return hdr.type, hdr.version
+    except (IOError, ValueError, struct.error):
+        return 4, ''
+#
+class PackCache(object):
+    """
+    Build cache kept in the unpacked directory: ROMIO blobs keyed by
+    the source content and settings, and the layout of the last image
+    packed with the checksum of every object in it
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.image_path = os.path.join(path, 'image.json')
+    def _create(self):
+        "Make the directory on the first write, packs failing early leave none"
+        if not os.path.isdir(self.path):
+            os.mkdir(self.path)
+    def romio(self, source_path, compression, type, version):
+        "Path to the ROMIO blob for an object, built if not cached yet"
+        key = hashlib.sha1(hash_file(source_path) + repr((compression, type, version))).hexdigest()
+        blob_path = os.path.join(self.path, key + '.rom')
+        if os.path.exists(blob_path):
+            print("Using cached ROMIO blob for '%s'." % source_path)
+        else:
+            print("Building ROMIO blob for '%s' (%s)..." % (source_path, compression))
+            self._create()
+            build_romio(source_path, blob_path + '.tmp', compression, type, version)
+            os.rename(blob_path + '.tmp', blob_path)
+        return blob_path
+    def identity(self, path):
+        "Content hash of a source file; cached blobs are named by theirs already"
+        if os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.path):
+            return os.path.basename(path)
+        return hash_file(path)
+    def previous_image(self, out_path, extents):
+        """
+        Records of the last image packed into out_path keyed by offset,
+        or None if it changed since or was laid out differently
+        """
+        try:
+            with open(self.image_path, 'r') as fp:
+                image = json.load(fp)
+            st = os.stat(out_path)
+        except (IOError, OSError, ValueError):
+            return None
+        if image['output'] != out_path or image['stat'] != [st.st_size, st.st_mtime]:
+            return None
+        if [(r['offset'], r['size']) for r in image['objects']] != extents:
+            return None
+        return dict((r['offset'], r) for r in image['objects'])
+    def save_image(self, out_path, records):
+        st = os.stat(out_path)
+        image = {'output': out_path, 'stat': [st.st_size, st.st_mtime], 'objects': records}
+        self._create()
+        with open(self.image_path, 'w') as fp:
+            json.dump(image, fp, sort_keys=True, encoding='latin-1')
+#
+COMPRESSION_METHODS = (None, 'lzma', 'lzma0', 'bzip2')
+
+def parse_compression(spec):
+    """
+    Split a compression spec, a method optionally followed by the LZMA
+    dictionary size (log2) as in 'lzma:20', into method and size
+    """
+    if spec is None:
+        return None, None
+    method, _, dict_bits = spec.partition(':')
+    if method not in COMPRESSION_METHODS:
+        raise ValueError("Unrecognized compression method requested: '%s'" % spec)
+    if method == 'bzip2':
+        if dict_bits:
+            raise ValueError("bzip2 takes no dictionary size: '%s'" % spec)
+        return method, None
+    if not dict_bits:
+        return method, LZMA_DICT_BITS
+    if not dict_bits.isdigit() or int(dict_bits) not in LZMA_DICT_RANGE:
+        raise ValueError("LZMA dictionary size must be %d..%d: '%s'" % (LZMA_DICT_RANGE[0], LZMA_DICT_RANGE[-1], spec))
+    return method, int(dict_bits)
+
+def build_romio(input_path, output_path, compression=None, type=4, version=''):
+    "Wrap an object into a ROMIO file, compressing it on the way; return the header"
+    method, dict_bits = parse_compression(compression)
     hdr = RomIoHeader()
-    hdr.type = args.type
+    hdr.type = type
     hdr.flags = 0x20
-    hdr.orig_length = len(data)
-    hdr.orig_checksum = checksum(data)
-    hdr.version = args.version
-    print("Input length: %08X, checksum: %04X" % (hdr.orig_length, hdr.orig_checksum))
-    if args.compression:
-        hdr.flags |= 0xC0
-        if args.compression == 'lzma' or args.compression == 'lzma0':
-            data = compress_lzma(data)
-            # Fix: splice in the file size
-            data = data[:5] + struct.pack('<Q', hdr.orig_length) + data[13:]
-        elif args.compression == 'bzip2':
-            data = compress_bz2(data)
-        else:
-            print("Unrecognized compression method requested: '%s'" % args.compression)
+    hdr.version = version
+    orig_csum = ZynosChecksum()
+    comp_csum = ZynosChecksum()
+    try:
+        with open(input_path, 'rb') as fp, open(output_path, 'wb') as out_fp:
+            hdr.orig_length = os.fstat(fp.fileno()).st_size
+            def source():
+                for data in iter(lambda: fp.read(STREAM_CHUNK), ''):
+                    orig_csum.update(data)
+                    yield data
+            # The header is filled in once the data has gone through.
+            out_fp.write(hdr.pack())
+            if method:
+                hdr.flags |= 0xC0
+                if method == 'lzma0':
+                    out_fp.write("\0\0\0")
+                if method == 'bzip2':
+                    stream = compress_bz2_stream(source())
+                else:
+                    # Fix: splice in the file size
+                    stream = splice_lzma_size(compress_lzma_stream(source(), dict_bits), hdr.orig_length)
+                for data in stream:
+                    write_checksummed(out_fp, comp_csum, data)
+            else:
+                for data in source():
+                    out_fp.write(data)
+            hdr.orig_checksum = orig_csum.digest()
+            if method:
+                hdr.comp_length = comp_csum.length
+                hdr.comp_checksum = comp_csum.digest()
+            out_fp.seek(0, 0)
+            out_fp.write(hdr.pack())
+    except:
+        # No half-written object is left behind.
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    return hdr
+#
+# Tried by "--compression auto", in order of preference on a tie.
+AUTO_CANDIDATES = (None, 'lzma', 'lzma:20', 'lzma:16', 'lzma0', 'bzip2')
+
+def trial_romio(task):
+    """
+    Auto-selection worker: build one candidate, time its compression
+    and decompression; return (size, compress time, decompress time,
+    None), or (None, None, None, reason) if it does not give the input
+    back
+    """
+    input_path, output_path, compression, type, version = task
+    started = time.time()
+    try:
+        hdr = build_romio(input_path, output_path, compression, type, version)
+    except Exception as e:
+        return None, None, None, str(e) or e.__class__.__name__
+    compress_time = time.time() - started
+    method = parse_compression(compression)[0]
+    started = time.time()
+    with Image(output_path) as image:
+        try:
+            if method:
+                data = DECOMPRESSORS[method](image.view(len(image) - hdr.comp_length))
+            else:
+                data = image.read(0x30, len(image) - 0x30)
+        except Exception as e:
+            return None, None, None, 'does not decompress: %s' % (str(e) or e.__class__.__name__)
+    decompress_time = time.time() - started
+    with open(input_path, 'rb') as fp:
+        if len(data) != hdr.orig_length or data != fp.read():
+            return None, None, None, 'does not decompress to the input'
+    return os.path.getsize(output_path), compress_time, decompress_time, None
+#
+def slot_size(args):
+    "Size available to the object: --slot-size, or its entry in a memory map"
+    if args.slot_size is not None:
+        return args.slot_size
+    if args.slot is None:
+        return None
+    map_path = args.map or os.path.join(os.path.dirname(args.output), '.map')
+    for mme in read_map(map_path):
+        if mme.name == args.slot and mme.type1 == 4:
+            return mme.length
+    raise ValueError("No ROMBIN slot '%s' in '%s'" % (args.slot, map_path))
+#
+def auto_romio(args):
+    """
+    Build the object with every candidate method in parallel, then keep
+    the smallest one that fits the slot, or the fastest to decompress
+    """
+    try:
+        limit = slot_size(args)
+    except (IOError, ValueError) as e:
+        print("Could not find the slot size: %s" % e)
+        return
+    if limit is not None:
+        print("Slot size: %08X" % limit)
+    tasks = []
+    for compression in AUTO_CANDIDATES:
+        fd, temp_path = tempfile.mkstemp(prefix='.romio-', dir=os.path.dirname(os.path.abspath(args.output)))
+        os.close(fd)
+        tasks.append((args.input_file, temp_path, compression, args.type, args.version))
+    try:
+        pool = multiprocessing.Pool(min(args.jobs, len(tasks)))
+        try:
+            results = pool.map(trial_romio, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+        print("%-10s %8s %10s %10s" % ('Method', 'Size', 'Compress', 'Decompr.'))
+        fitting = []
+        for task, (size, compress_time, decompress_time, failure) in zip(tasks, results):
+            if failure:
+                print("%-10s failed, %s" % (task[2] or 'none', failure))
+                continue
+            fits = limit is None or size <= limit
+            print("%-10s %08X %8.3f s %8.3f s%s" % (task[2] or 'none', size, compress_time, decompress_time, '' if fits else ' (does not fit)'))
+            if fits:
+                fitting.append((decompress_time if args.prefer == 'speed' else size, len(fitting), task))
+        if not any(result[3] is None for result in results):
+            raise RuntimeError("No compression method gave a working object")
+        if not fitting:
+            print("Nothing fits the slot!")
             return
-        hdr.comp_length = len(data)
-        hdr.comp_checksum = checksum(data)
+        task = min(fitting)[2]
+        print("Selected: %s" % (task[2] or 'none'))
+        publish(task[1], args.output)
+    finally:
+        for task in tasks:
+            if os.path.exists(task[1]):
+                os.remove(task[1])
+#
+def do_romio(args):
+    if args.compression == 'auto':
+        try:
+            auto_romio(args)
+        except RuntimeError as e:
+            print(e)
+        return
+    try:
+        parse_compression(args.compression)
+    except ValueError as e:
+        print(e)
+        return
+    try:
+        hdr = build_romio(args.input_file, args.output, args.compression, args.type, args.version)
+    except RuntimeError as e:
+        print(e)
+        return
+    print("Input length: %08X, checksum: %04X" % (hdr.orig_length, hdr.orig_checksum))
+    if hdr.flags & 0x80:
         print("Compressed length: %08X, checksum: %04X" % (hdr.comp_length, hdr.comp_checksum))
-        if args.compression == 'lzma0':
-            data = "\0\0\0" + data
-    with open(args.output, 'wb') as fp:
-        fp.write(hdr.pack())
-        fp.write(data)
 #
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -501,12 +1217,43 @@ if __name__ == '__main__':
         action='store_true',
         dest='dry_run',
         default=False)
+    parser_unpack.add_argument('--jobs',
+        help="number of processes to decompress objects with",
+        type=int,
+        default=1)
     parser_unpack.set_defaults(do=do_unpack)
 
+    parser_batch = subparsers.add_parser('batch', help='unpack a directory of firmware images')
+    parser_batch.add_argument('input_dir')
+    parser_batch.add_argument('--output-dir',
+        help="path for unpacked trees (default: <input_dir>.unpacked)",
+        dest='output_dir',
+        default=None)
+    parser_batch.add_argument('--summary',
+        help="JSON lines summary, also used to skip unchanged images (default: <input_dir>.jsonl)",
+        default=None)
+    parser_batch.add_argument('--jobs',
+        help="number of images to unpack in parallel",
+        type=int,
+        default=multiprocessing.cpu_count())
+    parser_batch.add_argument('--dry-run',
+        help="don't write unpacked trees or the summary, just print",
+        action='store_true',
+        dest='dry_run',
+        default=False)
+    parser_batch.set_defaults(do=do_batch)
+
     parser_pack = subparsers.add_parser('pack', help='pack the firmware')
     parser_pack.add_argument('input_dir')
+    parser_pack.add_argument('--output',
+        help="path for the packed image (default: ras)",
+        default='ras')
     parser_pack.set_defaults(do=do_pack)
 
+    parser_convert = subparsers.add_parser('convert', help='update the .map and .comp files of an unpacked tree')
+    parser_convert.add_argument('input_dir')
+    parser_convert.set_defaults(do=do_convert)
+
     parser_romio = subparsers.add_parser('romio', help='make ROMIO file')
     parser_romio.add_argument('input_file')
     parser_romio.add_argument('--type',
@@ -520,7 +1267,27 @@ if __name__ == '__main__':
     parser_romio.add_argument('--output',
         default='object.rom')
     parser_romio.add_argument('--compression',
+        help="lzma[:<dict bits>], lzma0[:<dict bits>], bzip2, or auto to try them all",
         default=None)
+    parser_romio.add_argument('--slot-size',
+        help="with auto: the most the ROMIO file may take",
+        type=lambda x: int(x, 0),
+        dest='slot_size',
+        default=None)
+    parser_romio.add_argument('--slot',
+        help="with auto: take the slot size from this ROMBIN entry of the memory map",
+        default=None)
+    parser_romio.add_argument('--map',
+        help="with --slot: memory map to look in (default: .map next to the output)",
+        default=None)
+    parser_romio.add_argument('--prefer',
+        help="with auto: keep the smallest (size) or fastest to decompress (speed) candidate",
+        choices=('size', 'speed'),
+        default='size')
+    parser_romio.add_argument('--jobs',
+        help="with auto: number of candidates to build in parallel",
+        type=int,
+        default=multiprocessing.cpu_count())
     parser_romio.set_defaults(do=do_romio)
     
     print("ZyNOS firmware tool by dev_zzo, version 1")
@@ -0,0 +1,365 @@
+"""
+NAND dump helpers shared by the ZyXEL tools.
+
+Dumps taken with the spare area have each page laid out as data
+followed by spare bytes (0x800 + 0x40 on the P-2x12HNU boards);
+some dumps are shifted by the size of one spare area.
+
+"""
+
+import binascii
+import os
+import struct
+
+# Page data sizes to consider; the spare area is 1/32 of that.
+DATA_SIZES = (0x200, 0x800, 0x1000)
+
+# Pages looked at to score a layout, spread over the whole image.
+PROBE_SAMPLES = 256
+
+# How far into the image the first Yaffs2 object header is looked for.
+PROBE_LIMIT = 0x400000
+
+# Scores this close to the best one are a tie.
+PROBE_TIE = 0.05
+
+# (data, spare) of the P-2x12HNU boards, assumed when nothing in the
+# dump tells otherwise.
+DEFAULT_LAYOUT = (0x800, 0x40)
+
+class Geometry(object):
+    "Where the pages are and where the Yaffs2 partition starts"
+
+    def __init__(self, data_size, spare_size, skew=0, yaffs_offset=None, endianness='be', score=0.0):
+        self.data_size = data_size
+        self.spare_size = spare_size
+        self.skew = skew
+        self.yaffs_offset = yaffs_offset
+        self.endianness = endianness
+        self.score = score
+    @property
+    def page_size(self):
+        return self.data_size + self.spare_size
+    @property
+    def boot_pages(self):
+        "Pages before the Yaffs2 partition, counted from the skew"
+        if self.yaffs_offset is None:
+            return None
+        return (self.yaffs_offset - self.skew) // self.page_size
+    def __str__(self):
+        lines = []
+        lines.append("  Page: %04X data + %02X spare, first page at %X" % (self.data_size, self.spare_size, self.skew))
+        if self.yaffs_offset is not None:
+            lines.append("  Yaffs2 (%s): at %08X, after %d pages" % (self.endianness, self.yaffs_offset, self.boot_pages))
+        else:
+            lines.append("  Yaffs2: not found")
+        lines.append("  Score: %.2f" % self.score)
+        if not self.score:
+            lines.append("  No evidence in the dump, layout assumed")
+        return "\n".join(lines)
+
+def marker_offset(data_size):
+    "Offset of the bad block marker in the spare area"
+    return 5 if data_size == 0x200 else 0
+
+def is_erased(data):
+    return data.count('\xff') == len(data)
+
+def has_tags(spare, endian):
+    "Whether a spare area holds plausible Yaffs2 packed tags"
+    if len(spare) < 2 + 16:
+        return False
+    seq, obj_id = struct.unpack_from(endian + 'II', spare, 2)
+    return 0 < seq < 0x100000 and 0 < obj_id & 0x0FFFFFFF < 0x40000
+
+def score_spare(image, data_size, spare_size, skew, samples=PROBE_SAMPLES):
+    """
+    Score a layout by the sampled pages with data in them: half for a
+    bad block marker reading as good (0xFF), half for Yaffs2 tags
+    where the spare area would be. Misplaced spare areas mostly land
+    in data and score low, or in 0xFF filler and miss the tags.
+    Returns the score and the number of pages with tags
+    """
+    page_size = data_size + spare_size
+    count = (len(image) - skew) // page_size
+    samples = min(samples, count)
+    marker = marker_offset(data_size)
+    width = 2 if marker == 0 else 1
+    hits = used = tagged = 0
+    for k in xrange(samples):
+        offset = skew + (k * count // samples) * page_size
+        if is_erased(image.read(offset, data_size)):
+            continue
+        used += 2
+        spare = image.read(offset + data_size, spare_size)
+        if spare[marker:marker + width] == '\xff' * width:
+            hits += 1
+        if has_tags(spare, '>') or has_tags(spare, '<'):
+            hits += 1
+            tagged += 1
+    return float(hits) / used if used else 0.0, tagged
+
+def looks_like_header(data, endian):
+    "Whether a page could start with a Yaffs2 object header"
+    if len(data) < 0x200:
+        return False
+    type, parent = struct.unpack_from(endian + 'II', data)
+    if not 1 <= type <= 5 or not 0 < parent < 0x40000:
+        return False
+    name = data[10:10 + 256]
+    if "\0" not in name:
+        return False
+    name = name[:name.index("\0")]
+    return all(' ' <= c < '\x7f' for c in name)
+
+def find_header(image, start, step, spare_at=None, limit=PROBE_LIMIT):
+    """
+    Offset and endianness of the first object header on a step grid,
+    or (None, None); with spare_at, its tags must mark it as a header
+    """
+    for offset in xrange(start, min(len(image), start + limit), step):
+        data = image.read(offset, 0x200)
+        for endian, endianness in (('>', 'be'), ('<', 'le')):
+            if not looks_like_header(data, endian):
+                continue
+            if spare_at is not None:
+                spare = image.read(offset + spare_at, 18)
+                if not has_tags(spare, endian) or not struct.unpack_from(endian + 'I', spare, 10)[0] & 0x80000000:
+                    continue
+            return offset, endianness
+    return None, None
+
+def best_layout(candidates):
+    "The best scoring Geometry; on a tie the default layout, then the smallest pages"
+    top = max(g.score for g in candidates)
+    return min((g for g in candidates if g.score >= top - PROBE_TIE),
+        key=lambda g: ((g.data_size, g.spare_size) != DEFAULT_LAYOUT, g.page_size, g.skew))
+
+def probe(image):
+    """
+    Guess the geometry of a NAND dump from a sample of its pages.
+
+    Layouts with a spare area are scored by the bad block markers and
+    Yaffs2 tags of the sampled pages. Markers alone say little, as any
+    0xFF filler reads as one, so without tags a layout also needs an
+    object header on its page grid. Without a spare area, the data size
+    is the largest one the first few object headers are aligned to.
+    With none of that, the result is DEFAULT_LAYOUT with a score of 0
+    """
+    candidates = []
+    for data_size in DATA_SIZES:
+        spare_size = data_size // 32
+        for skew in (0, spare_size):
+            score, tagged = score_spare(image, data_size, spare_size, skew)
+            candidates.append((Geometry(data_size, spare_size, skew, score=score), tagged))
+    tagged = [g for g, count in candidates if count]
+    if tagged:
+        best = best_layout(tagged)
+        if best.score >= 0.5:
+            best.yaffs_offset, endianness = find_header(image, best.skew, best.page_size, best.data_size)
+            if endianness is None:
+                # Tags in another format, go by the headers alone.
+                best.yaffs_offset, endianness = find_header(image, best.skew, best.page_size)
+            if endianness is not None:
+                best.endianness = endianness
+            return best
+
+    marked = []
+    for g, count in candidates:
+        if g.score >= 0.5:
+            g.yaffs_offset, endianness = find_header(image, g.skew, g.page_size)
+            if endianness is not None:
+                g.endianness = endianness
+                marked.append(g)
+    if marked:
+        return best_layout(marked)
+
+    # No spare area: look at where the object headers are.
+    offsets = []
+    offset, endianness = find_header(image, 0, DATA_SIZES[0])
+    while offset is not None and len(offsets) < 8:
+        offsets.append(offset)
+        offset = find_header(image, offset + DATA_SIZES[0], DATA_SIZES[0])[0]
+    if not offsets:
+        return Geometry(*DEFAULT_LAYOUT)
+    for data_size in reversed(DATA_SIZES):
+        if all(offset % data_size == offsets[0] % data_size for offset in offsets):
+            break
+    skew = offsets[0] % data_size
+    return Geometry(data_size, 0, skew, offsets[0], endianness, score=float(len(offsets)) / 8)
+
+# Linux software ECC: a 3-byte Hamming code for every 256 bytes of
+# data, kept at the end of the spare area on large page chips.
+# Ref: drivers/mtd/nand/nand_ecc.c
+
+ECC_BLOCK = 0x100
+
+def _byte_parities(value):
+    "Column parities CP0..CP5 of a byte in bits 0..5, its parity in bit 6"
+    bits = [value >> i & 1 for i in xrange(8)]
+    groups = ((0, 2, 4, 6), (1, 3, 5, 7), (0, 1, 4, 5), (2, 3, 6, 7), (0, 1, 2, 3), (4, 5, 6, 7))
+    result = 0
+    for i, group in enumerate(groups):
+        result |= (sum(bits[b] for b in group) & 1) << i
+    return result | (sum(bits) & 1) << 6
+_PARITIES = [_byte_parities(value) for value in xrange(256)]
+
+# Bit b of a byte moved to bit 2b
+_SPREAD = [sum((value >> b & 1) << 2 * b for b in xrange(8)) for value in xrange(256)]
+
+def _popcount(value):
+    return bin(value).count('1')
+
+_masks = {}
+def _ecc_masks(blocks):
+    """
+    Masks over blocks of data as one big integer, first byte on top:
+    bit 0 of every byte, every byte holding its index in the block,
+    and the low 2**n bits of every block
+    """
+    if blocks not in _masks:
+        low_bits = int('01' * ECC_BLOCK * blocks, 16)
+        indexes = int(''.join('%02x' % j for j in xrange(ECC_BLOCK)) * blocks, 16)
+        halves = []
+        shift = ECC_BLOCK * 4
+        while shift >= 8:
+            halves.append((shift, int(('0' * (ECC_BLOCK * 2 - shift // 4) + 'f' * (shift // 4)) * blocks, 16)))
+            shift >>= 1
+        _masks[blocks] = low_bits, indexes, halves
+    return _masks[blocks]
+
+def _fold(value, halves):
+    "XOR the bytes of every block together, into the block's last byte"
+    for shift, mask in halves:
+        value = (value ^ (value >> shift)) & mask
+    return value
+
+def hamming_ecc(data):
+    "The 3 ECC bytes of every 256-byte block of data, as a string"
+    blocks = len(data) // ECC_BLOCK
+    low_bits, indexes, halves = _ecc_masks(blocks)
+    x = int(binascii.hexlify(data), 16)
+    # The column parities are those of all the bytes XORed together,
+    # bit 6 of which is the parity of the whole block.
+    columns = _fold(x, halves)
+    # The line parities XOR together the indexes of the odd bytes.
+    odd = x ^ (x >> 4)
+    odd ^= odd >> 2
+    odd ^= odd >> 1
+    odd &= low_bits
+    lines = _fold((odd * 0xFF) & indexes, halves)
+    codes = []
+    for block in xrange(blocks):
+        shift = (blocks - 1 - block) * ECC_BLOCK * 8
+        parities = _PARITIES[columns >> shift & 0xFF]
+        reg1 = parities & 0x3F
+        reg3 = lines >> shift & 0xFF
+        reg2 = reg3 ^ (0xFF if parities & 0x40 else 0)
+        # Interleaved, LP15..LP0: bit b of reg3 is LP(2b+1), of reg2 LP(2b).
+        code = ~(_SPREAD[reg3] << 1 | _SPREAD[reg2])
+        codes.append(chr(code >> 8 & 0xFF) + chr(code & 0xFF) + chr((~reg1 << 2 | 3) & 0xFF))
+    return ''.join(codes)
+
+def hamming_correct(block, stored, computed):
+    """
+    Check a block against its stored ECC; return None if they match,
+    (byte, bit) of a single bit data error, 'ecc' for a single bit
+    error in the ECC itself, or 'uncorrectable'
+    """
+    d = [ord(a) ^ ord(b) for a, b in zip(stored, computed)]
+    if not d[0] | d[1] | d[2]:
+        return None
+    if ((d[0] ^ d[0] >> 1) & 0x55 == 0x55 and (d[1] ^ d[1] >> 1) & 0x55 == 0x55
+            and (d[2] ^ d[2] >> 1) & 0x54 == 0x54):
+        address = 0
+        for i in xrange(8):
+            address |= (d[i // 4] >> (7 - 2 * (i % 4)) & 1) << (7 - i)
+        bit = d[2] >> 7 << 2 | (d[2] >> 5 & 1) << 1 | d[2] >> 3 & 1
+        return address, bit
+    if _popcount(d[0]) + _popcount(d[1]) + _popcount(d[2]) == 1:
+        return 'ecc'
+    return 'uncorrectable'
+
+def ecc_positions(data_size, spare_size):
+    "Where the Linux default spare layout keeps the ECC bytes"
+    if data_size == 0x200:
+        return [0, 1, 2, 3, 6, 7]
+    count = data_size // ECC_BLOCK * 3
+    return range(spare_size - count, spare_size)
+
+# Data is written out in pieces of about this size.
+WRITE_SIZE = 0x100000
+
+def depage(image, out_fp, geometry, ecc=False, correct=False, positions=None):
+    """
+    Write the data areas of a NAND dump to out_fp, dropping the spare
+    areas. With ecc, every page is checked against the Linux software
+    ECC in its spare area, and with correct single bit errors are fixed,
+    unless the page has an uncorrectable one too. Blocks whose ECC
+    bytes are erased (0xFF) are not checked.
+    Returns a dict: the page count and the lists of pages with errors
+    corrected (or correctable), in the ECC bytes only, and uncorrectable
+    """
+    data_size = geometry.data_size
+    page_size = geometry.page_size
+    if positions is None:
+        positions = ecc_positions(data_size, geometry.spare_size)
+    report = {'pages': 0, 'corrected': [], 'ecc': [], 'uncorrectable': []}
+    pending = []
+    pending_size = 0
+    end = len(image)
+    for index, offset in enumerate(xrange(geometry.skew, end, page_size)):
+        data = image.view(offset, data_size)
+        if offset + page_size > end:
+            print 'NOTE: last page is short, %d bytes' % (end - offset)
+        elif ecc:
+            spare = image.read(offset + data_size, geometry.spare_size)
+            stored = ''.join(spare[i] for i in positions)
+            computed = hamming_ecc(image.read(offset, data_size))
+            fixed = None
+            broken = False
+            for block in xrange(data_size // ECC_BLOCK if stored != computed else 0):
+                code = stored[block * 3:block * 3 + 3]
+                if code == '\xff\xff\xff':
+                    # Erased, no ECC was ever written for the block.
+                    continue
+                chunk = image.read(offset + block * ECC_BLOCK, ECC_BLOCK)
+                result = hamming_correct(chunk, code, computed[block * 3:block * 3 + 3])
+                if result is None:
+                    continue
+                if result in ('ecc', 'uncorrectable'):
+                    report[result].append(index)
+                    broken = broken or result == 'uncorrectable'
+                    continue
+                report['corrected'].append(index)
+                if correct:
+                    if fixed is None:
+                        fixed = bytearray(data)
+                    fixed[block * ECC_BLOCK + result[0]] ^= 1 << result[1]
+            # Half a fix is no fix: a page with an uncorrectable block is left as read.
+            if fixed is not None and not broken:
+                data = fixed
+        report['pages'] += 1
+        pending.append(data)
+        pending_size += len(data)
+        if pending_size >= WRITE_SIZE:
+            _write_all(out_fp, pending)
+            pending = []
+            pending_size = 0
+    _write_all(out_fp, pending)
+    for key in ('corrected', 'ecc', 'uncorrectable'):
+        report[key] = sorted(set(report[key]))
+    return report
+
+def _write_all(out_fp, pieces):
+    if not pieces:
+        return
+    if hasattr(os, 'writev'):
+        out_fp.flush()
+        os.writev(out_fp.fileno(), pieces)
+        return
+    joined = bytearray()
+    for piece in pieces:
+        joined += piece
+    out_fp.write(joined)
+# EOF
@@ -14,12 +14,18 @@ Layout:
 * MIPS Linux-2.6.32 image
 * Unknown data
 
+Needs flashimage.py from the parent directory on PYTHONPATH.
+
 """
 
 import argparse
 import sys
 import os
 import struct
+from multiprocessing.pool import ThreadPool
+
+from flashimage import Image
+import nand
 
 # Ref: http://www.aleph1.co.uk/gitweb?p=yaffs2.git;a=blob;f=yaffs_guts.h
 
@@ -36,8 +42,20 @@ YAFFS_OBJECTID_LOSTNFOUND = 2
 YAFFS_OBJECTID_UNLINKED = 3
 YAFFS_OBJECTID_DELETED = 4
 
+# Ref: http://www.aleph1.co.uk/gitweb?p=yaffs2.git;a=blob;f=yaffs_packedtags2.c
+# Packed tags in the spare area: sequence number, object id, chunk id
+# and byte count; header chunks carry extra info in the top bits.
+YAFFS2_PACKED_TAGS = 'IIII'
+EXTRA_HEADER_INFO_FLAG = 0x80000000
+EXTRA_SHADOWS_FLAG = 0x20000000
+ALL_EXTRA_FLAGS = 0xF0000000
+EXTRA_OBJECT_TYPE_SHIFT = 28
+
+def endian_prefix(endianness):
+    return '>' if endianness == 'be' else '<'
+
 def yaffs2_obj_unpack(data, endianness='be'):
-    endian = '>' if endianness == 'be' else '<'
+    endian = endian_prefix(endianness)
     fmt = endian + 'IIxx255s3xIIIIIIII159sxIQQQIII4xII'
     values = struct.unpack(fmt, data)
     obj = {
@@ -65,82 +83,268 @@ def yaffs2_obj_unpack(data, endianness='be'):
     }
     return obj
 
-def unpack_next(fp, args, headers):
-    page = imgfp.read(args.page_size)
-    if len(page) < args.page_size:
-        return False
+# The fields of an object header needed to index it: type, parent,
+# name and the low word of the file size.
+YAFFS2_INDEX_FIELDS = 'II2x255s3x24xI'
+
+class YaffsObject(object):
+    "An index entry: where the object's header and data pages are"
+    __slots__ = ('obj_id', 'header_offset', 'type', 'parent_obj_id', 'name', 'size', 'chunks')
+
+    def __init__(self, obj_id, header_offset, type, parent_obj_id, name, size):
+        self.obj_id = obj_id
+        self.header_offset = header_offset
+        self.type = type
+        self.parent_obj_id = parent_obj_id
+        self.name = name
+        self.size = size
+        # File offsets of the data pages in chunk order, None for holes.
+        self.chunks = []
+
+class YaffsIndex(object):
+    """
+    All objects of a Yaffs2 partition, indexed by object id in a single
+    pass over the page headers; paths are resolved on demand and cached
+    """
+
+    def __init__(self, image, page_size, data_size, endianness='be'):
+        self.image = image
+        self.page_size = page_size
+        self.data_size = data_size
+        self.endianness = endianness
+        self.objects = {}
+        self._paths = {YAFFS_OBJECTID_ROOT: ''}
+    def __iter__(self):
+        "Objects in the order they are found in the image"
+        return iter(sorted(self.objects.itervalues(), key=lambda obj: obj.header_offset))
+    def add(self, obj):
+        self.objects[obj.obj_id] = obj
+    def path(self, obj_id):
+        "Path of an object relative to the root, None if it is not connected to it"
+        chain = []
+        while obj_id not in self._paths:
+            obj = self.objects.get(obj_id)
+            if obj is None or obj_id in chain:
+                return None
+            chain.append(obj_id)
+            obj_id = obj.parent_obj_id
+        path = self._paths[obj_id]
+        for obj_id in reversed(chain):
+            path = os.path.join(path, self.objects[obj_id].name)
+            self._paths[obj_id] = path
+        return path
+    def header(self, obj):
+        "The full header of an object, decoded on demand"
+        return yaffs2_obj_unpack(self.image.read(obj.header_offset, 0x200), self.endianness)
+    def data(self, obj):
+        "Views of an object's data, page by page up to the file size"
+        remaining = obj.size
+        for offset in obj.chunks:
+            size = min(remaining, self.data_size)
+            if size <= 0:
+                break
+            if offset is None:
+                yield "\0" * size
+            else:
+                yield self.image.view(offset, size)
+            remaining -= size
+    def find(self, path):
+        "The object at a path, or None"
+        path = os.path.normpath(path).strip('/')
+        for obj in self.objects.itervalues():
+            if self.path(obj.obj_id) == path:
+                return obj
+        return None
 
+def scan(image, offset, page_size, data_size, tags_offset=2, endianness='be'):
+    "Index the objects from the spare area tags, or from the header sequence if there are none"
+    index = scan_tags(image, offset, page_size, data_size, tags_offset, endianness)
+    if not index.objects:
+        print "No Yaffs2 tags found, assuming objects are stored in order"
+        index = scan_sequence(image, offset, page_size, data_size, endianness)
+    return index
+
+def is_config(image, offset):
+    "Whether the XML config that follows the Yaffs2 partition starts here"
     # This is BS. Need to figure out a better way, but ATM there's nothing.
-    if page[:5] == '<?xml' or page[3:8] == '<?xml':
-        imgfp.seek(-args.page_size, os.SEEK_CUR)
-        return False
-
-    header = yaffs2_obj_unpack(page[:0x200])
-    if not (YAFFS_OBJECT_TYPE_UNKNOWN <= header['type'] < YAFFS_OBJECT_TYPE_MAX):
-        print "Invalid object type %08x" % (header['type'])
-        return False
-
-    headers.append(header)
-    print "type: %d name: '%s' parent: %x" % (header['type'], header['name'], header['parent_obj_id'])
-    if header['name'] == '':
-        print "(dummy entry)"
-        return True
-
-    path_chunks = []
-    current_id = 0x100 + len(headers) - 1
-    try:
-        while current_id != YAFFS_OBJECTID_ROOT:
-            hh = headers[current_id - 0x100]
-            path_chunks.append(hh['name'])
-            current_id = hh['parent_obj_id']
-        obj_path = os.path.join(*reversed(path_chunks))
-    except IndexError:
-        print "Invalid current_id of %x" % (current_id)
-        return False
-
-    if header['type'] == YAFFS_OBJECT_TYPE_FILE:
-        print "%s (%d bytes)" % (obj_path, header['file_size_low'])
-
-        if not args.dry_run:
-            outfp = open(obj_path, 'wb')
-        size = header['file_size_low']
-        while size > 0:
-            page = imgfp.read(args.page_size)
-            if not args.dry_run:
-                outfp.write(page[:args.data_size])
-            size -= args.data_size
-        if not args.dry_run:
-            outfp.close()
-
-    elif header['type'] == YAFFS_OBJECT_TYPE_SYMLINK:
-        print "%s -> %s" % (obj_path, header['alias'])
-
-        if not args.dry_run:
-            os.symlink(header['alias'], obj_path)
-
-    elif header['type'] == YAFFS_OBJECT_TYPE_DIRECTORY:
-        print "%s" % (obj_path)
-
-        if not args.dry_run:
-            os.mkdir(obj_path, header['yst_mode'])
-
-    elif header['type'] == YAFFS_OBJECT_TYPE_SPECIAL:
-        major = header['yst_rdev'] >> 8
-        minor = header['yst_rdev'] & 0xFF
-        print "%s (%d,%d)" % (obj_path, major, minor)
-
-        # If cannot create the device -- ignore it.
+    tag = image.read(offset, 8)
+    return tag[:5] == '<?xml' or tag[3:8] == '<?xml'
+
+def partition_end(image, offset, page_size):
+    "Where the Yaffs2 partition ends: the XML config, or the end of the image"
+    while offset + page_size <= len(image) and not is_config(image, offset):
+        offset += page_size
+    return offset
+
+def scan_tags(image, offset, page_size, data_size, tags_offset, endianness='be'):
+    """
+    Index the objects by the packed tags in each page's spare area,
+    keeping the newest copy of every header and data chunk
+    """
+    index = YaffsIndex(image, page_size, data_size, endianness)
+    tags = struct.Struct(endian_prefix(endianness) + YAFFS2_PACKED_TAGS)
+    if data_size + tags_offset + tags.size > page_size:
+        return index
+    # (obj, chunk) -> (seq, offset); chunk 0 is the object header.
+    # Within a block, later pages are newer.
+    newest = {}
+    shadows = set()
+    end = partition_end(image, offset, page_size)
+    for page in xrange(offset, end, page_size):
+        seq, obj_id, chunk_id, n_bytes = image.unpack(tags, page + data_size + tags_offset)
+        if seq in (0, 0xFFFFFFFF):
+            # Erased or unused
+            continue
+        if chunk_id & EXTRA_HEADER_INFO_FLAG:
+            if chunk_id & EXTRA_SHADOWS_FLAG:
+                shadows.add((seq, page))
+            obj_id &= ~ALL_EXTRA_FLAGS
+            chunk_id = 0
+        key = (obj_id, chunk_id)
+        if newest.get(key, (0, 0)) < (seq, page):
+            newest[key] = (seq, page)
+
+    fields = struct.Struct(endian_prefix(endianness) + YAFFS2_INDEX_FIELDS)
+    chunks = {}
+    for (obj_id, chunk_id), (seq, page) in newest.iteritems():
+        if chunk_id:
+            chunks.setdefault(obj_id, {})[chunk_id] = page
+            continue
+        type, parent_obj_id, name, size = image.unpack(fields, page)
+        if not (YAFFS_OBJECT_TYPE_UNKNOWN <= type < YAFFS_OBJECT_TYPE_MAX):
+            print "Invalid object type %08x at %08x" % (type, page)
+            continue
+        index.add(YaffsObject(obj_id, page, type, parent_obj_id, name.rstrip("\0"), size))
+    # An object renamed over another one replaces it.
+    for seq, page in shadows:
+        header = yaffs2_obj_unpack(image.read(page, 0x200), endianness)
+        index.objects.pop(header['shadows_obj'], None)
+
+    for obj in index.objects.values():
+        if obj.parent_obj_id in (YAFFS_OBJECTID_UNLINKED, YAFFS_OBJECTID_DELETED) or obj.name == '':
+            del index.objects[obj.obj_id]
+        elif obj.type == YAFFS_OBJECT_TYPE_FILE:
+            pages = chunks.get(obj.obj_id, {})
+            count = (obj.size + data_size - 1) // data_size
+            obj.chunks = [pages.get(chunk_id) for chunk_id in xrange(1, count + 1)]
+    return index
+
+def scan_sequence(image, offset, page_size, data_size, endianness='be'):
+    "Index the objects whose header pages follow each other from offset on"
+    index = YaffsIndex(image, page_size, data_size, endianness)
+    fields = struct.Struct(endian_prefix(endianness) + YAFFS2_INDEX_FIELDS)
+    obj_id = 0x100
+    while offset + page_size <= len(image) and not is_config(image, offset):
+        type, parent_obj_id, name, size = image.unpack(fields, offset)
+        if not (YAFFS_OBJECT_TYPE_UNKNOWN <= type < YAFFS_OBJECT_TYPE_MAX):
+            print "Invalid object type %08x" % (type)
+            break
+        obj = YaffsObject(obj_id, offset, type, parent_obj_id, name.rstrip("\0"), size)
+        obj_id += 1
+        offset += page_size
+        if obj.name == '':
+            # Dummy entry
+            continue
+        index.add(obj)
+
+        if type == YAFFS_OBJECT_TYPE_FILE:
+            count = (size + data_size - 1) // data_size
+            obj.chunks = range(offset, offset + count * page_size, page_size)
+            offset += count * page_size
+    return index
+
+def describe(index, obj):
+    "One line describing an object for the listing"
+    obj_path = index.path(obj.obj_id)
+    if obj.type == YAFFS_OBJECT_TYPE_FILE:
+        return "%s (%d bytes)" % (obj_path, obj.size)
+    if obj.type == YAFFS_OBJECT_TYPE_SYMLINK:
+        return "%s -> %s" % (obj_path, index.header(obj)['alias'])
+    if obj.type == YAFFS_OBJECT_TYPE_SPECIAL:
+        rdev = index.header(obj)['yst_rdev']
+        return "%s (%d,%d)" % (obj_path, rdev >> 8, rdev & 0xFF)
+    if obj.type == YAFFS_OBJECT_TYPE_DIRECTORY:
+        return "%s" % (obj_path)
+    return "%s (not handled, type %d)" % (obj_path, obj.type)
+
+# File data is gathered into writes of about this size.
+WRITE_SIZE = 0x100000
+
+def write_file(task):
+    "Extraction worker: write one file's data in large pieces"
+    index, obj, obj_path = task
+    with open(obj_path, 'wb') as outfp:
+        pending = bytearray()
+        for data in index.data(obj):
+            pending += data
+            if len(pending) >= WRITE_SIZE:
+                outfp.write(pending)
+                del pending[:]
+        outfp.write(pending)
+
+def extract(index, objects, jobs=8, dry_run=False):
+    """
+    Create objects relative to the current directory: the directories
+    first, then file contents on a thread pool, then links and special
+    nodes, and the permissions last
+    """
+    paths = []
+    for obj in objects:
+        obj_path = index.path(obj.obj_id)
+        if obj_path is None:
+            print "Object %x is not connected to the root, skipped" % (obj.obj_id)
+            continue
+        print describe(index, obj)
+        paths.append((obj, obj_path))
+    if dry_run:
+        return
+
+    # Directories stay writable until everything is in them.
+    dirs = sorted((obj_path, obj) for obj, obj_path in paths if obj.type == YAFFS_OBJECT_TYPE_DIRECTORY)
+    for obj_path, obj in dirs:
+        if not os.path.isdir(obj_path):
+            os.mkdir(obj_path, 0755)
+
+    files = [(index, obj, obj_path) for obj, obj_path in paths if obj.type == YAFFS_OBJECT_TYPE_FILE]
+    if files:
+        pool = ThreadPool(max(1, min(jobs, len(files))))
         try:
-            if not args.dry_run:
-                os.mknod(obj_path, header['yst_mode'], os.makedev(major, minor))
-        except OSError:
-            pass
+            pool.map(write_file, files)
+        finally:
+            pool.close()
+            pool.join()
+
+    for obj, obj_path in paths:
+        if obj.type == YAFFS_OBJECT_TYPE_SYMLINK:
+            os.symlink(index.header(obj)['alias'], obj_path)
 
-    #elif header['type'] == YAFFS_OBJECT_TYPE_HARDLINK:
-    else:
-        print "%s (not handled, dumping)" % (obj_path)
-        print repr(header)
-    return True
+        elif obj.type == YAFFS_OBJECT_TYPE_SPECIAL:
+            header = index.header(obj)
+            # If cannot create the device -- ignore it.
+            try:
+                os.mknod(obj_path, header['yst_mode'], os.makedev(header['yst_rdev'] >> 8, header['yst_rdev'] & 0xFF))
+            except OSError:
+                pass
+
+        #elif obj.type == YAFFS_OBJECT_TYPE_HARDLINK:
+        elif obj.type not in (YAFFS_OBJECT_TYPE_FILE, YAFFS_OBJECT_TYPE_DIRECTORY):
+            print repr(index.header(obj))
+
+    # Deepest first, so no directory is locked before its contents.
+    for obj, obj_path in sorted(paths, key=lambda (obj, obj_path): obj_path, reverse=True):
+        if obj.type in (YAFFS_OBJECT_TYPE_FILE, YAFFS_OBJECT_TYPE_DIRECTORY):
+            os.chmod(obj_path, index.header(obj)['yst_mode'] & 07777)
+
+def selected(index, path):
+    "Objects at path and below it, or all of them"
+    if path is None:
+        return list(index)
+    top = index.find(path)
+    if top is None:
+        return []
+    prefix = index.path(top.obj_id) + '/'
+    return [obj for obj in index
+        if obj is top or (index.path(obj.obj_id) or '').startswith(prefix)]
 
 def num(x):
     return int(x, 0)
@@ -156,25 +360,72 @@ if __name__ == '__main__':
     parser.add_argument('--page-size',
         dest='page_size',
         type=num,
-        default=0x840,
-        help='flash page size, in hex')
+        default=None,
+        help='flash page size, in hex (default: detected)')
     parser.add_argument('--data-size',
         dest='data_size',
         type=num,
-        default=0x800,
-        help='flash data size, in hex')
+        default=None,
+        help='flash data size, in hex (default: detected)')
     parser.add_argument('--boot-pages',
         dest='boot_pages',
         type=num,
-        default=0x40,
-        help='number of pages taken by zboot')
+        default=None,
+        help='number of pages taken by zboot (default: detected)')
+    parser.add_argument('--skew',
+        type=num,
+        default=None,
+        help='offset of the first page, in hex (default: detected)')
+    parser.add_argument('--endianness',
+        choices=('be', 'le'),
+        default=None,
+        help='byte order of the Yaffs2 structures (default: detected)')
+    parser.add_argument('--tags-offset',
+        dest='tags_offset',
+        type=num,
+        default=2,
+        help='offset of the Yaffs2 tags in the spare area, in hex')
+    parser.add_argument('--list',
+        action='store_true',
+        help='only list the objects')
+    parser.add_argument('--extract',
+        metavar='PATH',
+        default=None,
+        help='extract only this path (and what is below it)')
+    parser.add_argument('--jobs',
+        type=int,
+        default=8,
+        help='number of files to write in parallel')
     args = parser.parse_args()
 
-    imgfp = open(args.image_path)
-    imgfp.seek(args.boot_pages * args.page_size)
-    headers = []
-
-    while unpack_next(imgfp, args, headers):
-        pass
+    with Image(args.image_path) as image:
+        if None in (args.page_size, args.data_size, args.boot_pages, args.skew, args.endianness):
+            geometry = nand.probe(image)
+            print "Detected geometry:"
+            print geometry
+            if args.page_size is None:
+                args.page_size = geometry.page_size
+            if args.data_size is None:
+                args.data_size = geometry.data_size
+            if args.skew is None:
+                args.skew = geometry.skew
+            if args.boot_pages is None:
+                args.boot_pages = geometry.boot_pages if geometry.yaffs_offset is not None else 0x40
+            if args.endianness is None:
+                args.endianness = geometry.endianness
+        offset = args.skew + args.boot_pages * args.page_size
+        index = scan(image, offset, args.page_size, args.data_size, args.tags_offset, args.endianness)
+        objects = selected(index, args.extract)
+        if args.extract is not None and not objects:
+            print "'%s' not found." % (args.extract)
+        elif args.list:
+            for obj in objects:
+                print describe(index, obj)
+        else:
+            if args.extract is not None and not args.dry_run:
+                parent = os.path.dirname(index.path(objects[0].obj_id))
+                if parent and not os.path.isdir(parent):
+                    os.makedirs(parent)
+            extract(index, objects, args.jobs, args.dry_run)
     print "Done."
 # EOF
@@ -0,0 +1,224 @@
+"""
+Decrypts and encrypts the "_encrypt_" values of ZyXEL VMG3925 configs,
+in bulk; vmg3925decrypt.c does one value per run.
+
+Values are base64 of AES-256-CBC, the key and IV derived from a fixed
+password with EVP_BytesToKey (SHA1, 5 rounds, fixed salt). Decrypting
+a config writes each value back as "_decrypted_" and the plain text,
+JSON-escaped; encrypting turns those into "_encrypt_" values again, so
+an edited copy can be imported.
+
+AES comes from PyCrypto if installed, otherwise from the openssl
+binary: all the values of a run are then decrypted in one process, and
+encrypted in one process per 16-byte block of the longest value.
+"""
+
+import argparse
+import base64
+import binascii
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+try:
+    from Crypto.Cipher import AES
+except ImportError:
+    # Fall back to running the openssl binary.
+    AES = None
+
+KEY = 'ThiSISEncryptioNKeY'
+SALT = '\x00\x00\x30\x39\x00\x00\xD4\x31'
+ROUNDS = 5
+BLOCK = 16
+
+OPENSSL = 'openssl'
+
+ENCRYPTED = re.compile(r'_encrypt_([A-Za-z0-9+/]+=*)')
+# Up to the end of the JSON string.
+DECRYPTED = re.compile(r'_decrypted_((?:[^"\\]|\\.)*)')
+
+_derived = {}
+
+def derive_key(password, salt=SALT, rounds=ROUNDS):
+    "EVP_BytesToKey with SHA1 for AES-256: (key, iv), derived once per password"
+    if (password, salt, rounds) not in _derived:
+        material = ''
+        digest = ''
+        while len(material) < 32 + BLOCK:
+            digest = digest + password + salt
+            for i in xrange(rounds):
+                digest = hashlib.sha1(digest).digest()
+            material += digest
+        _derived[password, salt, rounds] = (material[:32], material[32:32 + BLOCK])
+    return _derived[password, salt, rounds]
+
+def xor(a, b):
+    "Two strings of the same length XORed"
+    if not a:
+        return ''
+    return binascii.unhexlify('%0*x' % (len(a) * 2, int(binascii.hexlify(a), 16) ^ int(binascii.hexlify(b), 16)))
+
+def pad(data):
+    count = BLOCK - len(data) % BLOCK
+    return data + chr(count) * count
+
+def unpad(data):
+    count = ord(data[-1]) if data else 0
+    if not 0 < count <= BLOCK or data[-count:] != data[-1] * count:
+        raise ValueError("bad padding, wrong key?")
+    return data[:-count]
+
+def ecb(key, data, decrypt):
+    "AES-256-ECB of whole blocks"
+    if not data:
+        return ''
+    if AES is not None:
+        cipher = AES.new(key, AES.MODE_ECB)
+        return cipher.decrypt(data) if decrypt else cipher.encrypt(data)
+    p = subprocess.Popen([OPENSSL, 'enc', '-aes-256-ecb', '-d' if decrypt else '-e', '-nopad',
+        '-K', binascii.hexlify(key)], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    output = p.communicate(data)[0]
+    if p.returncode != 0 or len(output) != len(data):
+        raise RuntimeError("%s failed" % OPENSSL)
+    return output
+
+class Cipher(object):
+    """
+    AES-256-CBC with the key and IV of a password; CBC is done here
+    over ECB so that many values go through AES together
+    """
+
+    def __init__(self, password=KEY):
+        self.key, self.iv = derive_key(password)
+    def decrypt_many(self, texts):
+        "Plain texts of base64 values"
+        blobs = []
+        for text in texts:
+            try:
+                blob = base64.b64decode(text)
+            except TypeError:
+                raise ValueError("bad base64 '%s'" % text)
+            if not blob or len(blob) % BLOCK:
+                raise ValueError("'%s' is not whole AES blocks" % text)
+            blobs.append(blob)
+        decrypted = ecb(self.key, ''.join(blobs), True)
+        plains = []
+        offset = 0
+        for blob in blobs:
+            # Each block is XORed with the previous ciphertext block.
+            chained = self.iv + blob[:-BLOCK]
+            plains.append(unpad(xor(decrypted[offset:offset + len(blob)], chained)))
+            offset += len(blob)
+        return plains
+    def encrypt_many(self, plains):
+        "Base64 values of plain texts"
+        padded = [pad(plain) for plain in plains]
+        previous = [self.iv] * len(padded)
+        blobs = [[] for plain in padded]
+        # Block k of every value depends on its block k - 1: one pass per block.
+        for start in xrange(0, max(len(p) for p in padded) if padded else 0, BLOCK):
+            active = [i for i, p in enumerate(padded) if start < len(p)]
+            encrypted = ecb(self.key, ''.join(xor(padded[i][start:start + BLOCK], previous[i]) for i in active), False)
+            for n, i in enumerate(active):
+                previous[i] = encrypted[n * BLOCK:(n + 1) * BLOCK]
+                blobs[i].append(previous[i])
+        return [base64.b64encode(''.join(blob)) for blob in blobs]
+    def decrypt(self, text):
+        return self.decrypt_many([text])[0]
+    def encrypt(self, plain):
+        return self.encrypt_many([plain])[0]
+
+# Values are escaped as Latin-1 so that any bytes come back unchanged.
+def escape(plain):
+    return json.dumps(plain.decode('latin-1'))[1:-1]
+
+def unescape(text):
+    return json.loads('"%s"' % text).encode('latin-1')
+
+def _replace(texts, pattern, convert):
+    "texts with the matches of pattern replaced through convert, called once for all of them"
+    matches = [list(pattern.finditer(text)) for text in texts]
+    values = iter(convert([match.group(1) for ms in matches for match in ms]))
+    results = []
+    for text, ms in zip(texts, matches):
+        pieces = []
+        end = 0
+        for match in ms:
+            pieces.append(text[end:match.start()])
+            pieces.append(next(values))
+            end = match.end()
+        pieces.append(text[end:])
+        results.append(''.join(pieces))
+    return results, sum(len(ms) for ms in matches)
+
+def decrypt_configs(texts, cipher):
+    "(texts with the _encrypt_ values decrypted, number of values)"
+    return _replace(texts, ENCRYPTED,
+        lambda values: ['_decrypted_' + escape(plain) for plain in cipher.decrypt_many(values)])
+
+def encrypt_configs(texts, cipher):
+    "(texts with the _decrypted_ values encrypted again, number of values)"
+    return _replace(texts, DECRYPTED,
+        lambda values: ['_encrypt_' + value for value in cipher.encrypt_many([unescape(v) for v in values])])
+
+def output_path(path, args):
+    directory = args.output_dir if args.output_dir is not None else os.path.dirname(path)
+    return os.path.join(directory, os.path.basename(path) + args.suffix)
+
+def do_configs(args):
+    # With no paths given, they are read from standard input.
+    paths = args.paths or [line.strip() for line in sys.stdin if line.strip()]
+    texts = []
+    for path in paths:
+        with open(path, 'rb') as fp:
+            texts.append(fp.read())
+    convert = decrypt_configs if args.decrypt else encrypt_configs
+    results, count = convert(texts, Cipher(args.key))
+    for path, result in zip(paths, results):
+        with open(output_path(path, args), 'wb') as fp:
+            fp.write(result)
+    print "%d values %s in %d files." % (count, 'decrypted' if args.decrypt else 'encrypted', len(paths))
+
+def do_value(args):
+    cipher = Cipher(args.key)
+    if args.encrypt:
+        for value in cipher.encrypt_many(args.values):
+            print '_encrypt_' + value
+    else:
+        values = [value[len('_encrypt_'):] if value.startswith('_encrypt_') else value for value in args.values]
+        for value in cipher.decrypt_many(values):
+            print repr(value)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--key',
+        default=KEY,
+        help='password the AES key is derived from (default: %(default)s)')
+    subparsers = parser.add_subparsers()
+
+    for name, suffix, help in (('decrypt', '.decrypted', 'write copies of configs with the _encrypt_ values decrypted'),
+            ('encrypt', '.encrypted', 'write copies of decrypted configs ready to import')):
+        parser_configs = subparsers.add_parser(name, help=help)
+        parser_configs.add_argument('paths',
+            nargs='*',
+            help='config files (default: names read from standard input)')
+        parser_configs.add_argument('--suffix',
+            default=suffix,
+            help='appended to the names of the copies (default: %(default)s)')
+        parser_configs.add_argument('--output-dir',
+            dest='output_dir',
+            default=None,
+            help='where to write the copies (default: next to the configs)')
+        parser_configs.set_defaults(do=do_configs, decrypt=name == 'decrypt')
+
+    parser_value = subparsers.add_parser('value', help='decrypt or encrypt values given on the command line')
+    parser_value.add_argument('values',
+        nargs='+')
+    parser_value.add_argument('--encrypt',
+        action='store_true')
+    parser_value.set_defaults(do=do_value)
+
+    args = parser.parse_args()
+    args.do(args)
@@ -12,25 +12,70 @@ Applicable models:
 
 NOTES:
 * P-2812HNU-F3 1.00(AAHF.3)C0 didn't have 0x40 bytes at the beginning.
+* The page layout and any such shift are detected unless given.
+* With --ecc, pages are checked against the Linux software ECC kept
+  in the spare area; --correct fixes single bit errors.
+* Needs flashimage.py from the parent directory on PYTHONPATH.
 
 """
 
-import sys
+import argparse
+from flashimage import Image
+import nand
 
-useful_size = 0x800
-discard_size = 0x40
+def num(x):
+    return int(x, 0)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('input_path')
+parser.add_argument('output_path')
+parser.add_argument('--data-size',
+    dest='data_size',
+    type=num,
+    default=None,
+    help='data bytes per page, in hex (default: detected)')
+parser.add_argument('--spare-size',
+    dest='spare_size',
+    type=num,
+    default=None,
+    help='spare bytes per page, in hex (default: detected)')
+parser.add_argument('--skew',
+    type=num,
+    default=None,
+    help='offset of the first page, in hex (default: detected)')
+parser.add_argument('--ecc',
+    action='store_true',
+    help='check the pages against the software ECC in the spare area')
+parser.add_argument('--correct',
+    action='store_true',
+    help='fix single bit errors found by --ecc')
+args = parser.parse_args()
 
 print 'ZyXEL NAND Image Depager Tool'
-print 'Data/page = 0x%x bytes, Waste/page = 0x%x bytes' % (useful_size, discard_size)
-
-with open(sys.argv[1], 'rb') as infile, open(sys.argv[2], 'wb') as outfile:
-    page_size = useful_size + discard_size
-    while True:
-        page = infile.read(page_size)
-        data_len = len(page)
-        if data_len < page_size:
-            if data_len > 0:
-                print 'NOTE: last page size was %d, not handled properly' % data_len
-            break
-        outfile.write(page[:useful_size])
+
+with Image(args.input_path) as image:
+    if None in (args.data_size, args.spare_size, args.skew):
+        geometry = nand.probe(image)
+        print 'Detected geometry:'
+        print geometry
+    else:
+        geometry = nand.Geometry(args.data_size, args.spare_size)
+    if args.data_size is not None:
+        geometry.data_size = args.data_size
+    if args.spare_size is not None:
+        geometry.spare_size = args.spare_size
+    if args.skew is not None:
+        geometry.skew = args.skew
+
+    print 'Data/page = 0x%x bytes, Waste/page = 0x%x bytes' % (geometry.data_size, geometry.spare_size)
+
+    with open(args.output_path, 'wb') as outfile:
+        report = nand.depage(image, outfile, geometry, args.ecc or args.correct, args.correct)
+
+print '%d pages written' % report['pages']
+if args.ecc or args.correct:
+    for key, text in (('corrected', 'Single bit errors%s' % (' (corrected)' if args.correct else '')),
+            ('ecc', 'Errors in the ECC bytes'), ('uncorrectable', 'Uncorrectable errors')):
+        if report[key]:
+            print '%s in pages: %s' % (text, ' '.join('%d' % page for page in report[key]))
 print 'Done.'